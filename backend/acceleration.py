@@ -0,0 +1,183 @@
+import threading
+
+MiB = 1024 * 1024
+
+# Transfer settings per platform. `fragments` is where the tuner starts for
+# HLS/DASH sources (concurrent_fragment_downloads), `max_fragments` where it
+# stops. http_chunk_size splits plain HTTP downloads into ranged requests;
+# None leaves it to yt-dlp (its YouTube formats already ask for 10 MiB).
+PROFILES = {
+    'youtube': {'fragments': 4, 'max_fragments': 8, 'http_chunk_size': None, 'buffersize': 1 * MiB},
+    # Short clips from a CDN that throttles bursts of parallel requests
+    'instagram': {'fragments': 2, 'max_fragments': 4, 'http_chunk_size': None, 'buffersize': 256 * 1024},
+    'tiktok': {'fragments': 2, 'max_fragments': 4, 'http_chunk_size': None, 'buffersize': 256 * 1024},
+    'twitch': {'fragments': 6, 'max_fragments': 12, 'http_chunk_size': None, 'buffersize': 1 * MiB},
+    'vimeo': {'fragments': 4, 'max_fragments': 8, 'http_chunk_size': 10 * MiB, 'buffersize': 1 * MiB},
+    'default': {'fragments': 3, 'max_fragments': 8, 'http_chunk_size': None, 'buffersize': 512 * 1024},
+}
+
+# Only transfers at least this large say anything about throughput
+MIN_SAMPLE_BYTES = 4 * MiB
+# A level must beat the one below it by this much to justify climbing further
+GAIN = 0.10
+EWMA_WEIGHT = 0.3
+
+
+def profile_name(platform, extractor=None, host=None):
+    # request.platform when it names a profile ('playlist' and 'custom' do not),
+    # otherwise the yt-dlp extractor key ('YoutubeTab' -> youtube), otherwise the host
+    platform = (platform or '').lower()
+    if platform in PROFILES:
+        return platform
+    extractor = (extractor or '').lower()
+    host = (host or '').lower()
+    for name in PROFILES:
+        if extractor.startswith(name) or name in host:
+            return name
+    return 'default'
+
+
+class _Level:
+    __slots__ = ('fragments', 'rates', 'active', 'samples', 'failures')
+
+    def __init__(self, fragments):
+        self.fragments = fragments  # what the next download gets
+        self.rates = {}  # fragments -> EWMA of bytes/s observed with that many
+        self.active = 0  # fragment connections held by running downloads
+        self.samples = 0
+        self.failures = 0
+
+
+class Lease:
+    # Transfer options for one download plus the hook reporting its throughput
+    __slots__ = ('accelerator', 'key', 'fragments', 'options', 'fragmented', 'transferring', 'released')
+
+    def __init__(self, accelerator, key, fragments, options):
+        self.accelerator = accelerator
+        self.key = key
+        self.fragments = fragments
+        self.options = options  # yt-dlp options
+        self.fragmented = False
+        self.transferring = False  # a transfer started and has not finished (cut off if the run failed)
+        self.released = False
+
+    def progress_hook(self, d):
+        # Runs on every chunk next to the task's own hook; only fragmented
+        # (HLS/DASH) transfers are fed to the tuner
+        if d['status'] == 'downloading':
+            self.transferring = True
+            if not self.fragmented and d.get('fragment_count'):
+                self.fragmented = True
+        elif d['status'] == 'finished':
+            self.transferring = False
+            if self.fragmented:
+                self.fragmented = False
+                size = d.get('total_bytes') or d.get('downloaded_bytes') or 0
+                elapsed = d.get('elapsed') or 0
+                if size >= MIN_SAMPLE_BYTES and elapsed > 0:
+                    self.accelerator._sample(self, size / elapsed)
+
+    def failed(self):
+        # The attempt failed (throttled, reset, 403...): back off for the retry
+        self.accelerator._failed(self)
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.accelerator._release(self)
+
+
+class Accelerator:
+    # Picks concurrent_fragment_downloads per (profile, host) and tunes it
+    # from observed throughput: additive increase while one more fragment
+    # connection still buys GAIN more bytes/s than one fewer did, a step
+    # down when it costs throughput, halving when a download fails. Downloads
+    # from one host share `host_connections` fragment connections (each still
+    # gets at least one).
+
+    def __init__(self, host_connections=16, autotune=True):
+        self.host_connections = max(1, host_connections)
+        self.autotune = autotune
+        self._lock = threading.Lock()
+        self._levels = {}  # (profile, host) -> _Level
+        self._host_active = {}  # host -> fragment connections in use
+
+    def lease(self, platform, extractor=None, host=None):
+        name = profile_name(platform, extractor, host)
+        profile = PROFILES[name]
+        key = (name, host or '')
+        with self._lock:
+            level = self._levels.get(key)
+            if level is None:
+                level = self._levels[key] = _Level(profile['fragments'])
+            in_use = self._host_active.get(key[1], 0)
+            fragments = max(1, min(level.fragments, self.host_connections - in_use))
+            level.active += fragments
+            self._host_active[key[1]] = in_use + fragments
+        options = {'concurrent_fragment_downloads': fragments, 'buffersize': profile['buffersize']}
+        if profile['http_chunk_size']:
+            options['http_chunk_size'] = profile['http_chunk_size']
+        return Lease(self, key, fragments, options)
+
+    def _sample(self, lease, rate):
+        profile = PROFILES[lease.key[0]]
+        with self._lock:
+            level = self._levels[lease.key]
+            level.samples += 1
+            previous = level.rates.get(lease.fragments)
+            level.rates[lease.fragments] = rate if previous is None else previous + EWMA_WEIGHT * (rate - previous)
+            if not self.autotune or lease.fragments != level.fragments:
+                return  # measured at a level we have since moved away from
+            current = level.rates[lease.fragments]
+            below = level.rates.get(lease.fragments - 1)
+            if below is None or current >= below * (1 + GAIN):
+                level.fragments = min(lease.fragments + 1, profile['max_fragments'])
+            elif current < below:
+                level.fragments = max(lease.fragments - 1, 1)
+
+    def _failed(self, lease):
+        with self._lock:
+            level = self._levels[lease.key]
+            level.failures += 1
+            if self.autotune:
+                level.fragments = max(1, min(level.fragments, lease.fragments) // 2)
+                # Throughput seen at the higher levels no longer applies
+                level.rates = {n: r for n, r in level.rates.items() if n <= level.fragments}
+            fragments = max(1, lease.fragments // 2)
+            if not lease.released:
+                # A released lease already gave all its connections back
+                freed = lease.fragments - fragments
+                level.active -= freed
+                self._host_active[lease.key[1]] -= freed
+        lease.fragments = fragments
+        lease.options['concurrent_fragment_downloads'] = fragments
+
+    def _release(self, lease):
+        with self._lock:
+            self._levels[lease.key].active -= lease.fragments
+            host = lease.key[1]
+            self._host_active[host] -= lease.fragments
+            if self._host_active[host] <= 0:
+                del self._host_active[host]
+
+    def levels(self):
+        # {(profile, host): fragments the next download gets}
+        with self._lock:
+            return {key: level.fragments for key, level in self._levels.items()}
+
+    def stats(self):
+        with self._lock:
+            return {
+                "autotune": self.autotune,
+                "host_connections": self.host_connections,
+                "levels": {
+                    f"{name}@{host}" if host else name: {
+                        "fragments": level.fragments,
+                        "active": level.active,
+                        "samples": level.samples,
+                        "failures": level.failures,
+                        "rates": {str(n): int(r) for n, r in sorted(level.rates.items())},
+                    }
+                    for (name, host), level in self._levels.items()
+                },
+            }
@@ -0,0 +1,203 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from bounded_executor import ExecutorSaturated
+from metadata_cache import normalize_url
+from task_state import FINISHED_STATES
+
+
+def request_key(request):
+    # Items with the same key would produce the same output and share one task
+    return (
+        normalize_url(request.url), request.type, request.quality,
+        bool(request.isPlaylist), request.playlist_start, request.playlist_end,
+    )
+
+
+class Batch:
+    __slots__ = ('batch_id', 'items', 'created_at')
+
+    def __init__(self, batch_id, items, created_at=None):
+        self.batch_id = batch_id
+        self.items = items  # [{"index", "url", "task_id", "duplicate_of"?}] in submission order
+        self.created_at = created_at or time.time()
+
+    def task_ids(self):
+        # Unique task ids, first occurrence order
+        return list(OrderedDict.fromkeys(item['task_id'] for item in self.items))
+
+
+def plan_batch(requests):
+    # (batch, [(task_id, request)] to run). Duplicates point at the first
+    # item with the same key instead of getting a task of their own.
+    items = []
+    unique = []
+    first = {}  # request key -> index of its first item
+    for index, request in enumerate(requests):
+        key = request_key(request)
+        item = {"index": index, "url": request.url}
+        if key in first:
+            leader = items[first[key]]
+            item["task_id"] = leader["task_id"]
+            item["duplicate_of"] = leader["index"]
+        else:
+            first[key] = index
+            item["task_id"] = str(uuid.uuid4())
+            unique.append((item["task_id"], request))
+        items.append(item)
+    return Batch(str(uuid.uuid4()), items), unique
+
+
+def summarize(batch, snapshot_fn):
+    # Aggregate status of a batch plus one compact status per item
+    snapshots = {task_id: snapshot_fn(task_id) for task_id in batch.task_ids()}
+    counts = {}
+    progress = 0.0
+    for snapshot in snapshots.values():
+        status = snapshot.get('status', 'unknown') if snapshot else 'unknown'
+        counts[status] = counts.get(status, 0) + 1
+        if status == 'completed':
+            progress += 100
+        elif snapshot:
+            progress += snapshot.get('progress') or 0
+
+    items = []
+    for item in batch.items:
+        snapshot = snapshots.get(item['task_id']) or {}
+        entry = dict(item)
+        entry["status"] = snapshot.get('status', 'unknown')
+        for field in ('progress', 'lane', 'queue_position', 'file_id', 'files', 'output_type', 'error', 'cache_hit'):
+            if snapshot.get(field) is not None:
+                entry[field] = snapshot[field]
+        items.append(entry)
+
+    tasks = len(snapshots)
+    finished = sum(n for status, n in counts.items() if status in FINISHED_STATES)
+    return {
+        "batch_id": batch.batch_id,
+        "created_at": batch.created_at,
+        "total": len(batch.items),
+        "unique": tasks,
+        "counts": counts,
+        "progress": round(progress / tasks, 1) if tasks else 100.0,
+        "done": finished == tasks,
+        "items": items,
+    }
+
+
+class BatchRegistry:
+    # batch_id -> Batch for batches submitted to this worker, oldest dropped
+    # after `ttl` seconds or once more than `max_batches` exist. Other workers
+    # find them through the task store.
+
+    def __init__(self, store, ttl=6 * 3600, max_batches=500):
+        self.store = store
+        self.ttl = ttl
+        self.max_batches = max_batches
+        self._batches = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, batch):
+        with self._lock:
+            self._batches[batch.batch_id] = batch
+            self._evict()
+        self.store.save_batch(batch.batch_id, batch.items, batch.created_at)
+
+    def get(self, batch_id):
+        with self._lock:
+            batch = self._batches.get(batch_id)
+        if batch is not None:
+            return batch
+        row = self.store.load_batch(batch_id)
+        if row is None:
+            return None
+        items, created_at = row
+        return Batch(batch_id, items, created_at)
+
+    def stats(self):
+        with self._lock:
+            return {"batches": len(self._batches)}
+
+    def _evict(self):
+        # Callers must hold self._lock
+        cutoff = time.time() - self.ttl
+        while self._batches:
+            batch = next(iter(self._batches.values()))
+            if batch.created_at >= cutoff and len(self._batches) <= self.max_batches:
+                break
+            self._batches.popitem(last=False)
+
+
+class BatchPrefetcher:
+    # Extracts metadata for a batch on the extraction pool ahead of its
+    # downloads. At most `concurrency` URLs are in flight per batch so
+    # interactive /api/extract calls keep room on the pool; each group of
+    # items is handed to `on_ready` as soon as its URL's info is cached, so
+    # the first downloads start while the rest are still being extracted.
+
+    def __init__(self, executor, load, peek, concurrency, timeout):
+        self.executor = executor
+        self.load = load  # url -> info, fills the metadata cache
+        self.peek = peek  # url -> cached info or None
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self.prefetched = 0
+        self.cached = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def run(self, groups, on_ready):
+        # groups: [(url, payload)]; on_ready(payload) is called exactly once per group
+        thread = threading.Thread(target=self._feed, args=(groups, on_ready), name="batch-prefetch", daemon=True)
+        thread.start()
+        return thread
+
+    def _feed(self, groups, on_ready):
+        slots = threading.Semaphore(self.concurrency)
+        for url, payload in groups:
+            if self.peek(url) is not None:
+                self._count('cached')
+                self._ready(on_ready, payload)
+                continue
+            slots.acquire()
+            try:
+                future = self.executor.submit(self.load, url, timeout=self.timeout)
+            except (ExecutorSaturated, RuntimeError):
+                # Pool busy (or shutting down): the download extracts for itself
+                slots.release()
+                self._count('skipped')
+                self._ready(on_ready, payload)
+                continue
+            future.add_done_callback(lambda f, p=payload: self._done(f, p, slots, on_ready))
+
+    def _done(self, future, payload, slots, on_ready):
+        slots.release()
+        if future.cancelled() or future.exception() is not None:
+            # The download retries the extraction and reports the error itself
+            self._count('failed')
+        else:
+            self._count('prefetched')
+        self._ready(on_ready, payload)
+
+    def _ready(self, on_ready, payload):
+        try:
+            on_ready(payload)
+        except Exception as e:
+            print(f"Batch prefetch: scheduling failed: {e}")
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "concurrency": self.concurrency,
+                "prefetched": self.prefetched,
+                "cached": self.cached,
+                "skipped": self.skipped,
+                "failed": self.failed,
+            }
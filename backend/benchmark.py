@@ -0,0 +1,399 @@
+# Offline benchmark for the API. Serves generated fixture media from a local
+# HTTP server (yt-dlp's generic extractor handles the direct links, the RSS
+# playlist and the DASH manifest), drives the app in-process and writes the
+# measurements as JSON so runs can be compared between releases.
+#
+#   cd backend
+#   python benchmark.py --out bench.json
+#   python benchmark.py --baseline bench.json     # also prints ratios vs a previous run
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+FINISHED = ('completed', 'error', 'cancelled', 'interrupted')
+
+
+def percentiles(samples):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+
+    def pick(p):
+        return round(ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))], 4)
+
+    return {
+        "n": len(ordered),
+        "mean": round(statistics.fmean(ordered), 4),
+        "p50": pick(50),
+        "p90": pick(90),
+        "p99": pick(99),
+        "max": round(ordered[-1], 4),
+    }
+
+
+# --- Fixtures -------------------------------------------------------------
+
+class Fixtures:
+    # Media files generated once per run in a temp dir. Without FFmpeg only
+    # the opaque blob exists and the merge/upscale scenarios are skipped.
+
+    def __init__(self, root, blob_mb, clip_seconds):
+        self.root = root
+        self.ffmpeg = shutil.which('ffmpeg')
+        self.files = {}
+        blob = os.path.join(root, 'blob.mp4')
+        with open(blob, 'wb') as f:
+            chunk = os.urandom(1024 * 1024)
+            for _ in range(blob_mb):
+                f.write(chunk)
+        self.files['blob.mp4'] = (blob, 'video/mp4')
+        if self.ffmpeg:
+            self._generate(clip_seconds)
+
+    def _ffmpeg(self, *args):
+        subprocess.run([self.ffmpeg, '-y', '-v', 'error', *args], check=True)
+
+    def _generate(self, seconds):
+        clip = os.path.join(self.root, 'clip.mp4')
+        video = os.path.join(self.root, 'video.mp4')
+        audio = os.path.join(self.root, 'audio.m4a')
+        src = ['-f', 'lavfi', '-i', f'testsrc=size=854x480:rate=25:duration={seconds}',
+               '-f', 'lavfi', '-i', f'sine=frequency=440:duration={seconds}']
+        self._ffmpeg(*src, '-c:v', 'libx264', '-g', '50', '-c:a', 'aac', '-shortest', clip)
+        self._ffmpeg('-i', clip, '-map', '0:v', '-c', 'copy', video)
+        self._ffmpeg('-i', clip, '-map', '0:a', '-c', 'copy', audio)
+        self.files['clip.mp4'] = (clip, 'video/mp4')
+        self.files['video.mp4'] = (video, 'video/mp4')
+        self.files['audio.m4a'] = (audio, 'audio/mp4')
+        self.clip_seconds = seconds
+
+    def mpd(self, base):
+        # Separate video and audio representations: downloads need a merge
+        seconds = self.clip_seconds
+        return f"""<?xml version="1.0" encoding="UTF-8"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static" mediaPresentationDuration="PT{seconds}S" minBufferTime="PT2S" profiles="urn:mpeg:dash:profile:isoff-on-demand:2011">
+  <Period>
+    <AdaptationSet mimeType="video/mp4" contentType="video">
+      <Representation id="v480" codecs="avc1.64001e" width="854" height="480" bandwidth="800000">
+        <BaseURL>{base}/media/video.mp4</BaseURL>
+      </Representation>
+    </AdaptationSet>
+    <AdaptationSet mimeType="audio/mp4" contentType="audio" lang="en">
+      <Representation id="a128" codecs="mp4a.40.2" audioSamplingRate="44100" bandwidth="128000">
+        <BaseURL>{base}/media/audio.m4a</BaseURL>
+      </Representation>
+    </AdaptationSet>
+  </Period>
+</MPD>
+"""
+
+    @staticmethod
+    def rss(base, count):
+        items = "".join(
+            f"<item><title>Item {i}</title><guid>item-{i}</guid>"
+            f"<enclosure url=\"{base}/media/item-{i}.mp4\" type=\"video/mp4\"/></item>"
+            for i in range(1, count + 1)
+        )
+        return f"""<?xml version="1.0"?><rss version="2.0"><channel><title>Bench Feed</title>{items}</channel></rss>"""
+
+
+class FixtureServer:
+    # Any /media/<name> whose name is not a fixture serves the blob, so each
+    # job can use a distinct URL and bypass the result cache.
+
+    def __init__(self, fixtures):
+        self.fixtures = fixtures
+        handler = self._handler()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.httpd.daemon_threads = True
+        self.base = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="bench-fixtures", daemon=True)
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_HEAD(self):
+                self._respond(head=True)
+
+            def do_GET(self):
+                self._respond(head=False)
+
+            def _respond(self, head):
+                parts = urlsplit(self.path)
+                if parts.path == '/feed.xml':
+                    count = int(parse_qs(parts.query).get('n', ['5'])[0])
+                    return self._send_bytes(Fixtures.rss(server.base, count).encode(), 'application/rss+xml', head)
+                if parts.path.startswith('/dash/') and 'video.mp4' in server.fixtures.files:
+                    return self._send_bytes(server.fixtures.mpd(server.base).encode(), 'application/dash+xml', head)
+                if parts.path.startswith('/media/'):
+                    name = parts.path[len('/media/'):]
+                    path, ctype = server.fixtures.files.get(name, server.fixtures.files['blob.mp4'])
+                    return self._send_file(path, ctype, head)
+                self.send_error(404)
+
+            def _send_bytes(self, body, ctype, head):
+                self.send_response(200)
+                self.send_header('Content-Type', ctype)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if not head:
+                    self.wfile.write(body)
+
+            def _send_file(self, path, ctype, head):
+                size = os.path.getsize(path)
+                start, end = 0, size - 1
+                rng = self.headers.get('Range')
+                if rng and rng.startswith('bytes='):
+                    first, _, last = rng[6:].partition('-')
+                    start = int(first or 0)
+                    end = min(int(last), size - 1) if last else size - 1
+                    self.send_response(206)
+                    self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+                else:
+                    self.send_response(200)
+                self.send_header('Content-Type', ctype)
+                self.send_header('Accept-Ranges', 'bytes')
+                self.send_header('Content-Length', str(end - start + 1))
+                self.end_headers()
+                if head:
+                    return
+                try:
+                    with open(path, 'rb') as f:
+                        f.seek(start)
+                        remaining = end - start + 1
+                        while remaining:
+                            chunk = f.read(min(256 * 1024, remaining))
+                            if not chunk:
+                                break
+                            self.wfile.write(chunk)
+                            remaining -= len(chunk)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+        return Handler
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+# --- Scenarios --------------------------------------------------------------
+
+class Bench:
+    def __init__(self, client, service, fixtures, base, args):
+        self.client = client
+        self.service = service
+        self.fixtures = fixtures
+        self.base = base
+        self.args = args
+
+    def run_job(self, payload, timeout=600):
+        # Queue a download and wait for it; returns (seconds, final status)
+        started = time.perf_counter()
+        resp = self.client.post('/api/queue-download', json=payload)
+        resp.raise_for_status()
+        task_id = resp.json()['task_id']
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            status = self.client.get(f'/api/status/{task_id}').json()
+            if status.get('status') in FINISHED:
+                return time.perf_counter() - started, status
+            time.sleep(0.02)
+        return time.perf_counter() - started, {"status": "timeout"}
+
+    def video_job(self, url, quality='720', **extra):
+        return {"url": url, "platform": "youtube", "type": "video", "quality": quality, **extra}
+
+    def extract_latency(self):
+        urls = {
+            "single": f"{self.base}/media/blob.mp4",
+            "playlist": f"{self.base}/feed.xml?n={self.args.playlist_size}",
+        }
+        out = {}
+        for name, url in urls.items():
+            cold, warm = [], []
+            for _ in range(self.args.iterations):
+                self.service.metadata_cache.clear()
+                started = time.perf_counter()
+                self.client.post("/api/extract", json=self.video_job(url, quality="1080")).raise_for_status()
+                cold.append(time.perf_counter() - started)
+                started = time.perf_counter()
+                self.client.post("/api/extract", json=self.video_job(url, quality="1080")).raise_for_status()
+                warm.append(time.perf_counter() - started)
+            out[name] = {"cold": percentiles(cold), "warm": percentiles(warm)}
+        return out
+
+    def throughput(self):
+        samples = []
+        size = self.args.blob_mb * 1024 * 1024
+        for i in range(self.args.downloads):
+            seconds, status = self.run_job(self.video_job(f"{self.base}/media/tp-{uuid.uuid4().hex[:8]}.mp4"))
+            if status.get('status') != 'completed':
+                return {"error": status}
+            samples.append(size / seconds / 1024 ** 2)
+        return {"file_mb": self.args.blob_mb, "mb_per_s": percentiles(samples)}
+
+    def merge(self):
+        if 'video.mp4' not in self.fixtures.files:
+            return {"skipped": "FFmpeg not available"}
+        samples = []
+        for _ in range(self.args.downloads):
+            # 480p source and target: a plain merge, no upscale
+            seconds, status = self.run_job(self.video_job(f"{self.base}/dash/{uuid.uuid4().hex[:8]}.mpd", quality='480'))
+            if status.get('status') != 'completed':
+                return {"error": status}
+            samples.append(seconds)
+        return {"seconds": percentiles(samples)}
+
+    def upscale(self):
+        if 'clip.mp4' not in self.fixtures.files:
+            return {"skipped": "FFmpeg not available"}
+        out = {}
+        for quality in self.args.upscale_to:
+            # A fresh name per run so neither the metadata nor the result cache answers
+            seconds, status = self.run_job(self.video_job(f"{self.base}/media/clip.mp4?r={uuid.uuid4().hex[:8]}", quality=quality))
+            if status.get('status') != 'completed':
+                out[quality] = {"error": status}
+                continue
+            out[quality] = {"seconds": round(seconds, 3), "source_seconds": self.fixtures.clip_seconds}
+        return out
+
+    def concurrency(self):
+        size = self.args.blob_mb * 1024 * 1024
+        out = {}
+        for level in self.args.concurrency:
+            payloads = [self.video_job(f"{self.base}/media/cc-{uuid.uuid4().hex[:8]}.mp4") for _ in range(level)]
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=level) as pool:
+                results = list(pool.map(self.run_job, payloads))
+            makespan = time.perf_counter() - started
+            failed = sum(1 for _, status in results if status.get('status') != 'completed')
+            out[str(level)] = {
+                "makespan": round(makespan, 3),
+                "job_seconds": percentiles([seconds for seconds, _ in results]),
+                "aggregate_mb_per_s": round(level * size / makespan / 1024 ** 2, 2),
+                "failed": failed,
+            }
+        return out
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(current, baseline, path=()):
+    # Flat list of (metric, baseline, current, ratio) for every shared number
+    rows = []
+    for key, value in current.items():
+        other = baseline.get(key) if isinstance(baseline, dict) else None
+        if isinstance(value, dict):
+            rows += compare(value, other or {}, path + (key,))
+        elif isinstance(value, (int, float)) and isinstance(other, (int, float)) and other:
+            rows.append(('.'.join(path + (key,)), other, value, round(value / other, 3)))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the download API")
+    parser.add_argument('--out', help="write results JSON here (default: stdout)")
+    parser.add_argument('--baseline', help="results JSON of a previous run to compare against")
+    parser.add_argument('--iterations', type=int, default=20, help="extract requests per scenario")
+    parser.add_argument('--downloads', type=int, default=3, help="sequential jobs per download scenario")
+    parser.add_argument('--blob-mb', type=int, default=32, help="size of the throughput fixture")
+    parser.add_argument('--clip-seconds', type=int, default=20, help="length of the generated clip")
+    parser.add_argument('--playlist-size', type=int, default=50)
+    parser.add_argument('--concurrency', default='1,2,4,8')
+    parser.add_argument('--upscale-to', default='1440')
+    parser.add_argument('--only', help="comma separated scenarios to run")
+    args = parser.parse_args()
+    args.concurrency = [int(c) for c in args.concurrency.split(',') if c]
+    args.upscale_to = [q for q in args.upscale_to.split(',') if q]
+
+    workdir = tempfile.mkdtemp(prefix='bench-')
+    fixture_dir = os.path.join(workdir, 'fixtures')
+    os.makedirs(fixture_dir)
+    fixtures = Fixtures(fixture_dir, args.blob_mb, args.clip_seconds)
+    server = FixtureServer(fixtures)
+    server.start()
+
+    # The app keeps downloads and its databases in the working directory
+    here = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, here)
+    os.chdir(workdir)
+    os.environ.setdefault('TASK_DB_PATH', os.path.join(workdir, 'tasks.db'))
+    os.environ.setdefault('DOWNLOAD_PER_HOST_LIMIT', str(max(args.concurrency + [1])))
+
+    from fastapi.testclient import TestClient
+    import main as app_module
+
+    results = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "ffmpeg": bool(fixtures.ffmpeg),
+            "started_at": time.time(),
+            "args": {k: v for k, v in vars(args).items() if k not in ('out', 'baseline')},
+        },
+    }
+    scenarios = ['extract_latency', 'throughput', 'merge', 'upscale', 'concurrency']
+    if args.only:
+        scenarios = [s for s in scenarios if s in args.only.split(',')]
+
+    try:
+        with TestClient(app_module.app) as client:
+            bench = Bench(client, app_module.downloader_service, fixtures, server.base, args)
+            for name in scenarios:
+                print(f"Benchmark: {name}...", file=sys.stderr)
+                started = time.perf_counter()
+                results[name] = getattr(bench, name)()
+                print(f"Benchmark: {name} done in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+            results["service"] = client.get('/api/cache/stats').json()
+    finally:
+        server.stop()
+        os.chdir(here)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for metric, old, new, ratio in compare(results, baseline):
+            if metric.startswith(('meta.', 'service.')):
+                continue
+            print(f"{metric:60s} {old:>12} -> {new:>12}  x{ratio}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ExecutorSaturated(Exception):
+    pass
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class BoundedExecutor:
+    # Thread pool with a hard cap on queued work. submit() fails fast with
+    # ExecutorSaturated instead of letting the backlog grow without bound,
+    # and jobs whose deadline passed while queued are dropped unrun.
+
+    def __init__(self, max_workers, max_queue, name="worker"):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self.rejected = 0
+        self.expired = 0
+
+    def submit(self, fn, *args, timeout=None, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise ExecutorSaturated(f"{self._pending} jobs pending")
+
+        deadline = time.monotonic() + timeout if timeout else None
+        with self._lock:
+            self._pending += 1
+
+        def run():
+            with self._lock:
+                self._running += 1
+            try:
+                if deadline is not None and time.monotonic() > deadline:
+                    with self._lock:
+                        self.expired += 1
+                    raise DeadlineExceeded("Deadline passed while queued")
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._running -= 1
+
+        try:
+            future = self._pool.submit(run)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        return future
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "running": self._running,
+                "queued": self._pending - self._running,
+                "rejected": self.rejected,
+                "expired": self.expired,
+            }
+
+    def shutdown(self, wait=False):
+        self._pool.shutdown(wait=wait, cancel_futures=True)
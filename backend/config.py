@@ -0,0 +1,114 @@
+import os
+
+# Runtime tuning knobs. Everything can be overridden through environment
+# variables so the Docker image does not need rebuilding to resize things.
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+# Metadata cache (yt-dlp info dicts keyed on normalized URL)
+METADATA_CACHE_SIZE = _env_int("METADATA_CACHE_SIZE", 256)
+METADATA_CACHE_TTL = _env_float("METADATA_CACHE_TTL", 600)
+
+# /api/extract runs on its own bounded pool so slow extractions never block the event loop
+EXTRACT_WORKERS = _env_int("EXTRACT_WORKERS", 4)
+EXTRACT_QUEUE_DEPTH = _env_int("EXTRACT_QUEUE_DEPTH", 16)
+EXTRACT_TIMEOUT = _env_float("EXTRACT_TIMEOUT", 45)
+# A streamed extraction gives up on a client that has not read anything for this long
+EXTRACT_STREAM_STALL_TIMEOUT = _env_float("EXTRACT_STREAM_STALL_TIMEOUT", 30)
+
+# Download scheduler: "light" lane for native/audio jobs, "heavy" lane for ffmpeg re-encodes
+DOWNLOAD_LIGHT_WORKERS = _env_int("DOWNLOAD_LIGHT_WORKERS", 4)
+DOWNLOAD_HEAVY_WORKERS = _env_int("DOWNLOAD_HEAVY_WORKERS", max(1, (os.cpu_count() or 2) // 2))
+DOWNLOAD_PER_HOST_LIMIT = _env_int("DOWNLOAD_PER_HOST_LIMIT", 3)
+
+# Concurrent entry downloads per playlist task
+PLAYLIST_WORKERS = _env_int("PLAYLIST_WORKERS", 3)
+
+# Progress push channel: per-task updates are coalesced and sent at most once per interval
+PROGRESS_PUSH_INTERVAL = _env_float("PROGRESS_PUSH_INTERVAL", 0.25)
+
+# Task bookkeeping: progress hook throttle and retention of finished tasks
+PROGRESS_HOOK_INTERVAL = _env_float("PROGRESS_HOOK_INTERVAL", 0.5)
+FINISHED_TASK_TTL = _env_float("FINISHED_TASK_TTL", 6 * 3600)
+FINISHED_TASK_LIMIT = _env_int("FINISHED_TASK_LIMIT", 2000)
+
+# Task store shared between uvicorn workers: "sqlite" (default) or "memory"
+TASK_STORE = os.environ.get("TASK_STORE", "sqlite")
+TASK_DB_PATH = os.environ.get("TASK_DB_PATH", os.path.join(os.getcwd(), "tasks.db"))
+TASK_STORE_FLUSH_INTERVAL = _env_float("TASK_STORE_FLUSH_INTERVAL", 0.5)
+# A worker that has not written a heartbeat for this long is considered dead
+TASK_OWNER_TIMEOUT = _env_float("TASK_OWNER_TIMEOUT", 30)
+
+# Result cache: finished outputs reused for identical requests, LRU-evicted past the quota
+RESULT_CACHE_DB = os.environ.get("RESULT_CACHE_DB", TASK_DB_PATH)
+RESULT_CACHE_QUOTA = _env_float("RESULT_CACHE_QUOTA_GB", 20) * 1024 ** 3  # 0 disables the quota
+
+# Stream-through mode: chunk size and how many chunks may be buffered ahead of the client
+STREAM_CHUNK_SIZE = _env_int("STREAM_CHUNK_SIZE", 256 * 1024)
+STREAM_BUFFER_CHUNKS = _env_int("STREAM_BUFFER_CHUNKS", 16)
+
+# Upscale transcoder: segments of one video are encoded in parallel on a shared pool
+# of ffmpeg processes. 0 threads / empty preset = chosen per job from duration and height.
+TRANSCODE_WORKERS = _env_int("TRANSCODE_WORKERS", max(1, (os.cpu_count() or 2) // 2))
+TRANSCODE_THREADS_PER_JOB = _env_int("TRANSCODE_THREADS_PER_JOB", 0)
+TRANSCODE_SEGMENT_SECONDS = _env_float("TRANSCODE_SEGMENT_SECONDS", 20)
+TRANSCODE_PRESET = os.environ.get("TRANSCODE_PRESET") or None
+
+# Resumable downloads: incomplete downloads are retried with exponential backoff,
+# continuing their .part files. Tasks interrupted by a shutdown or crash are
+# re-enqueued on the next start if they are younger than RECOVERY_MAX_AGE.
+DOWNLOAD_RETRIES = _env_int("DOWNLOAD_RETRIES", 3)
+DOWNLOAD_RETRY_BACKOFF = _env_float("DOWNLOAD_RETRY_BACKOFF", 2)
+DOWNLOAD_RETRY_BACKOFF_MAX = _env_float("DOWNLOAD_RETRY_BACKOFF_MAX", 60)
+RECOVER_ON_STARTUP = os.environ.get("RECOVER_ON_STARTUP", "1") not in ("0", "false", "no")
+RECOVERY_MAX_AGE = _env_float("RECOVERY_MAX_AGE", 24 * 3600)
+
+# Batch submissions: metadata for a batch is prefetched on the extraction pool,
+# at most BATCH_PREFETCH_CONCURRENCY URLs at a time, ahead of its downloads
+BATCH_MAX_ITEMS = _env_int("BATCH_MAX_ITEMS", 500)
+BATCH_PREFETCH_CONCURRENCY = _env_int("BATCH_PREFETCH_CONCURRENCY", max(1, EXTRACT_WORKERS // 2))
+
+# Pool of pre-built YoutubeDL instances per option profile (extract, audio, video...):
+# idle instances kept per profile, and checkouts before an instance is rebuilt
+YDL_POOL_MAX_IDLE = _env_int("YDL_POOL_MAX_IDLE", 4)
+YDL_POOL_MAX_USES = _env_int("YDL_POOL_MAX_USES", 200)
+YDL_POOL_WARM = _env_int("YDL_POOL_WARM", 1)
+
+# Download acceleration: HLS/DASH fragments fetched in parallel, per-platform
+# starting points (see acceleration.PROFILES) tuned from observed throughput.
+# ACCEL_HOST_CONNECTIONS caps the fragment connections open to one host.
+ACCEL_HOST_CONNECTIONS = _env_int("ACCEL_HOST_CONNECTIONS", 16)
+ACCEL_AUTOTUNE = os.environ.get("ACCEL_AUTOTUNE", "1") not in ("0", "false", "no")
+
+# Thumbnail proxy for playlist entries: images are fetched once, shrunk to
+# THUMB_WIDTH (Pillow if installed, else ffmpeg) and kept in an LRU disk cache.
+# Set THUMB_SECRET to share signed URLs across hosts; by default one is generated
+# inside THUMB_CACHE_DIR.
+THUMB_PROXY = os.environ.get("THUMB_PROXY", "1") not in ("0", "false", "no")
+THUMB_CACHE_DIR = os.environ.get("THUMB_CACHE_DIR", os.path.join(os.getcwd(), "thumbs"))
+THUMB_CACHE_MB = _env_float("THUMB_CACHE_MB", 512)
+THUMB_WIDTH = _env_int("THUMB_WIDTH", 320)
+THUMB_SECRET = os.environ.get("THUMB_SECRET") or None
+THUMB_FETCH_TIMEOUT = _env_float("THUMB_FETCH_TIMEOUT", 10)
+# Public origin of this API for thumbnail links (e.g. https://api.example.com);
+# by default the origin each request came in on
+THUMB_BASE_URL = os.environ.get("THUMB_BASE_URL") or None
+
+# Staging: running tasks work in STAGING_DIR (default downloads/.staging), which
+# should be on the same filesystem as downloads/ so a finished task is published
+# with one directory rename. Jobs expected to need at most STAGING_SMALL_MB can
+# stage in STAGING_SMALL_DIR instead (e.g. a tmpfs like /dev/shm/downify); they
+# are copied to downloads/ when done.
+STAGING_DIR = os.environ.get("STAGING_DIR") or None
+STAGING_SMALL_DIR = os.environ.get("STAGING_SMALL_DIR") or None
+STAGING_SMALL_MB = _env_float("STAGING_SMALL_MB", 256)
@@ -1,14 +1,68 @@
 import yt_dlp
 import os
 import threading
+import time
 import json
 import shutil
+import copy
+import itertools
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeout
+import config
+from metadata_cache import MetadataCache
+from scheduler import LIGHT, HEAVY, host_of
+from task_state import TaskRegistry, EntryState, FINISHED_STATES
+from task_store import create_task_store
+from result_cache import ResultCache, result_key
+from format_index import FormatIndex
+import metrics
+from transcoder import Transcoder
+import media_probe
+from ydl_pool import YDLPool
+from acceleration import Accelerator
+from thumbnails import ThumbnailCache
+from staging import Staging
+
+
+class TaskCancelled(yt_dlp.utils.DownloadCancelled):
+    msg = 'Cancelled by user'
+
+
+class TaskInterrupted(yt_dlp.utils.DownloadCancelled):
+    # Worker is shutting down: partial data is kept and the task resumed on the next start
+    msg = 'Interrupted by shutdown'
+
+
+MANIFEST = '.manifest.json'
+
 
 class Downloader:
     def __init__(self):
         self.downloads_dir = os.path.join(os.getcwd(), "downloads")
         os.makedirs(self.downloads_dir, exist_ok=True)
-        self.tasks = {} # task_id -> {status, progress, file_id, error}
+        self.tasks = TaskRegistry(config.FINISHED_TASK_TTL, config.FINISHED_TASK_LIMIT)
+        # Journal visible to every worker process; local registry stays the hot path
+        self.store = create_task_store(
+            config.TASK_STORE, config.TASK_DB_PATH,
+            flush_interval=config.TASK_STORE_FLUSH_INTERVAL,
+            owner_timeout=config.TASK_OWNER_TIMEOUT,
+            retention=config.FINISHED_TASK_TTL,
+        )
+        self.results = ResultCache(self.downloads_dir, config.RESULT_CACHE_DB, config.RESULT_CACHE_QUOTA)
+        # Task dirs while running; published into downloads_dir by one rename
+        self.staging = Staging(
+            self.downloads_dir, config.STAGING_DIR or os.path.join(self.downloads_dir, '.staging'),
+            config.STAGING_SMALL_DIR, config.STAGING_SMALL_MB * 1024 * 1024,
+        )
+        interrupted = self.store.mark_interrupted()
+        if interrupted:
+            print(f"Task store: {interrupted} task(s) from stopped workers marked interrupted")
+        # Shared by /api/extract and process_download so a URL is only extracted once
+        self.metadata_cache = MetadataCache(config.METADATA_CACHE_SIZE, config.METADATA_CACHE_TTL)
+        self.cancelled = set() # task_ids asked to stop; checked from the progress hook
+        self._lock = threading.Lock()
+        self.listeners = [] # callables (task_id, status) told about every task state change
+        self._pp_started = {} # (task_id, postprocessor stage, thread) -> perf_counter at start
+        self.suspending = False # set on shutdown; running downloads stop and are journaled as interrupted
         
         # Check for FFmpeg once on init
         # Check for FFmpeg once on init
@@ -17,9 +71,47 @@ class Downloader:
             print("WARNING: FFmpeg not found. High quality video merging will be disabled.")
         else:
             print("FFmpeg detected. High quality enabled.")
+        self.transcoder = Transcoder(
+            config.TRANSCODE_WORKERS, config.TRANSCODE_THREADS_PER_JOB,
+            config.TRANSCODE_SEGMENT_SECONDS, config.TRANSCODE_PRESET,
+        )
+        # Warmed YoutubeDL instances; built lazily, or ahead of time by start_warmup()
+        self.ydl_pool = YDLPool(self._ydl_profiles(), config.YDL_POOL_MAX_IDLE, config.YDL_POOL_MAX_USES)
+        # Fragment concurrency and chunking per platform, tuned from observed throughput
+        self.accelerator = Accelerator(config.ACCEL_HOST_CONNECTIONS, config.ACCEL_AUTOTUNE)
+        # Playlist entries link their thumbnails through /api/thumb (None: origin URLs)
+        self.thumbnails = ThumbnailCache(
+            config.THUMB_CACHE_DIR, config.THUMB_CACHE_MB * 1024 * 1024, config.THUMB_WIDTH,
+            config.THUMB_SECRET, config.THUMB_FETCH_TIMEOUT, config.THUMB_BASE_URL,
+        ) if config.THUMB_PROXY else None
 
-    def extract_info(self, url):
-        ydl_opts = {
+    def _ydl_profiles(self):
+        # One profile per kind of yt-dlp run. Per-task options (output path,
+        # hooks, format, playlist range) are applied at checkout.
+        download = self._download_opts()
+        return {
+            'extract': self._extract_opts(),
+            'stream': {'quiet': True, 'force_ipv4': True, 'socket_timeout': 15},
+            'audio': {**download, 'format': 'bestaudio/best'},
+            'video-native': {**download, 'merge_output_format': 'mp4'},
+            'video-upscale': {**download, 'format': 'bestvideo+bestaudio/best', 'merge_output_format': 'mp4'},
+        }
+
+    def _download_opts(self):
+        return {
+            # 'quiet': True,
+            'verbose': True,
+            # Resume: keep finished files and continue .part files left by an earlier attempt
+            'overwrites': False,
+            'continuedl': True,
+            'ignoreerrors': True,
+            'restrictedfilenames': True,
+            'force_ipv4': True,
+            'ffmpeg_location': shutil.which('ffmpeg'),
+        }
+
+    def _extract_opts(self):
+        return {
             'quiet': True,
             'skip_download': True,
             'force_ipv4': True,
@@ -32,150 +124,393 @@ class Downloader:
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
             }
         }
-        
-        try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                
-                if 'entries' in info:
-                    # It's a playlist or multiple items
-                    entries = []
-                    # Handle cases where entries is a generator or list
-                    raw_entries = list(info.get('entries', []))
-                    
-                    for idx, entry in enumerate(raw_entries):
-                        if idx > 2000: break 
-                        if not entry: continue
-                        
-                        entries.append({
-                            "index": idx + 1,
-                            "id": entry.get('id', 'N/A'),
-                            "title": entry.get('title', f'Video {idx+1}'),
-                            "duration": entry.get('duration', 0),
-                            "thumbnail": entry.get('thumbnails', [{}])[-1].get('url') if entry.get('thumbnails') else None
-                        })
-
-                    return {
-                        "is_playlist": True,
-                        "title": info.get('title', 'Playlist'),
-                        "count": len(entries),
-                        "platform": info.get('extractor_key', 'custom'),
-                        "entries": entries
-                    }
-                
-                # ... (previous code) ...
-                
-                # Single video
-                formats = info.get('formats', [])
-                duration = info.get('duration', 0)
-                
-                # Helper to get size
-                def get_size(f):
-                    if f.get('filesize'): return f['filesize']
-                    if f.get('filesize_approx'): return f['filesize_approx']
-                    # Use Total Bitrate (tbr) if available
-                    if f.get('tbr') and duration: return int(f['tbr'] * 1000 / 8 * duration)
-                    # Use Video+Audio Bitrate if available
-                    if f.get('vbr') and duration:
-                        vbr = f['vbr']
-                        abr = f.get('abr', 128) # Default audio 128k
-                        return int((vbr + abr) * 1000 / 8 * duration)
-                    return 0
-
-                # Find best audio size (for merging)
-                best_audio_size = 0
-                audio_formats = [f for f in formats if f.get('vcodec') == 'none' and f.get('acodec') != 'none']
-                if audio_formats:
-                    best_audio_f = max(audio_formats, key=lambda x: x.get('abr', 0) or 0)
-                    best_audio_size = get_size(best_audio_f)
-
-                # Map qualities to sizes
-                sizes = {}
-                
-                # Video Sizes (Video Stream + Best Audio Stream)
-                # First, gather all available unique heights
-                unique_heights = sorted(list(set([f.get('height') for f in formats if f.get('height') and f.get('vcodec') != 'none'])))
-                
-                for q in unique_heights:
-                    candidates = [f for f in formats if f.get('height') == q and f.get('vcodec') != 'none']
-                    if candidates:
-                        best_vid = max(candidates, key=lambda x: get_size(x))
-                        vid_size = get_size(best_vid)
-                        
-                        if vid_size > 0:
-                            if best_vid.get('acodec') != 'none':
-                                total = vid_size
-                            else:
-                                total = vid_size + best_audio_size
-                            sizes[str(q)] = total
-
-                # Audio Sizes
-                if duration:
-                    sizes['128'] = int(128 * 1000 / 8 * duration)
-                    sizes['320'] = int(320 * 1000 / 8 * duration)
-
-                # Fallback Estimation for missing sizes (e.g. Instagram)
-                # Check for "0" sizes or missing sizes and estimate them
-                # We prioritize the calculated sizes above, but if they failed (0), we guess.
-                
-                # If sizes is empty but we have duration, we should populate for standard resolutions if they "likely" exist?
-                # Actually, for Instagram, we usually only see one resolution.
-                
-                for k, v in sizes.items():
-                    if v == 0 and duration:
-                         # key is resolution (str)
-                         if k.isdigit():
-                             res = int(k)
-                             # Revised Constants (More Realistic for Web/Social Media)
-                             # 1080p: ~2000kbps (was 3000)
-                             # 720p: ~1000kbps (was 1500)
-                             # 480p: ~700kbps
-                             bitrate = 2000 if res >= 1080 else 1000 if res >= 720 else 700
-                             sizes[k] = int(bitrate * 1000 / 8 * duration)
-                             
-                # Special Case: If we have NO sizes but valid duration (e.g. some Instagram cases with no heights parsed?)
-                # We assume 1080p equivalent exists.
-                if not sizes and duration:
-                    sizes['1080'] = int(2000 * 1000 / 8 * duration)
-
-                # Get Direct Playback URL
-                playback_url = info.get('url')
-                if not playback_url:
-                     # Try to find a suitable mp4 format for playback
-                     playback_formats = [f for f in formats if f.get('vcodec') != 'none' and f.get('acodec') != 'none' and f.get('ext') == 'mp4']
-                     if playback_formats:
-                         playback_url = playback_formats[-1].get('url') # Use the last (usually highest quality) one
-
-                return {
-                    "is_playlist": False,
-                    "id": info.get('id'),
-                    "title": info.get('title') or 'Downify Media',
-                    "view_count": info.get('view_count'),
-                    "thumb": info.get('thumbnail'),
-                    "duration": duration,
-                    "platform": info.get('extractor_key'),
-                    "sizes": sizes,
-                    "video_url": playback_url
-                }
 
+    def _load_info(self, url):
+        with metrics.span('extract'), self.ydl_pool.checkout('extract') as ydl:
+            info = ydl.extract_info(url, download=False)
+        if info and info.get('entries') is not None:
+            # Materialize generators so the cached dict can be read many times
+            info['entries'] = list(info['entries'])
+        return info
+
+    def format_index(self, info):
+        # Built on first use and kept inside the (cached) info dict; yt-dlp
+        # treats double-underscore keys as private.
+        index = info.get('__format_index')
+        if index is None:
+            index = info['__format_index'] = FormatIndex(info)
+        return index
 
+    def get_info(self, url):
+        # Raw yt-dlp info dict, shared through the metadata cache. Treat as read-only.
+        return self.metadata_cache.get_or_load(url, self._load_info)
+
+    def extract_info(self, url, base_url=None):
+        # base_url: scheme://host the client reached the API on, for absolute thumbnail links
+        try:
+            return self.summarize_info(self.get_info(url), base_url)
         except Exception as e:
             # Fallback if something fails
             print(f"Extraction error: {e}")
             return {"title": "Unknown Media", "thumbnail": "", "sizes": {}}
 
+    def iter_extract(self, url, offset=0, limit=None, base_url=None):
+        # Yields NDJSON-ready dicts: a playlist header, then one dict per entry
+        # as yt-dlp produces them, then an end marker. Single media yields one
+        # "media" dict. Entries are never materialized as a whole.
+        cached = self.metadata_cache.peek(url)
+        if cached is not None:
+            yield from self._iter_summary(cached, offset, limit, base_url)
+            return
+
+        with self.ydl_pool.checkout('extract', lazy_playlist=True) as ydl:
+            info = ydl.extract_info(url, download=False, process=False)
+            if not info:
+                raise Exception("Extraction failed")
+
+            if info.get('_type') not in ('playlist', 'multi_video'):
+                # Single media (or a redirect): resolve fully and share via the cache
+                info = ydl.process_ie_result(info, download=False)
+                if info and info.get('_type') not in ('playlist', 'multi_video'):
+                    self.metadata_cache.put(url, info)
+                yield from self._iter_summary(info, offset, limit, base_url)
+                return
+
+            yield from self._iter_summary(info, offset, limit, base_url)
+
+    def _iter_summary(self, info, offset, limit, base_url=None):
+        if 'entries' not in info:
+            yield {"type": "media", **self.summarize_info(info, base_url)}
+            return
+
+        yield {"type": "playlist", **self._playlist_header(info)}
+        entries = info['entries']
+        stop = offset + limit if limit is not None else None
+        if hasattr(entries, 'getslice'):
+            # PagedList: only fetch the pages covering the requested window
+            window = enumerate(entries.getslice(offset, stop), start=offset)
+        else:
+            window = itertools.islice(enumerate(entries), offset, stop)
+
+        consumed = count = 0
+        for idx, entry in window:
+            consumed += 1
+            if not entry:
+                continue
+            count += 1
+            yield {"type": "entry", **self._entry_summary(idx, entry, base_url)}
+
+        done = stop is None or consumed < limit
+        yield {"type": "end", "count": count, "offset": offset, "next_offset": None if done else offset + consumed}
+
+    def _entry_summary(self, idx, entry, base_url=None):
+        # idx is 0-based position in the playlist
+        return {
+            "index": idx + 1,
+            "id": entry.get('id', 'N/A'),
+            "title": entry.get('title', f'Video {idx+1}'),
+            "duration": entry.get('duration', 0),
+            "thumbnail": self._entry_thumbnail(entry, base_url),
+        }
+
+    def _entry_thumbnail(self, entry, base_url=None):
+        # The smallest variant still as wide as a list thumbnail (the largest
+        # when widths are unknown), served through the resize proxy
+        thumbnails = [t for t in entry.get('thumbnails') or [] if t.get('url')]
+        if not thumbnails:
+            url = entry.get('thumbnail')
+        else:
+            wide = [t for t in thumbnails if (t.get('width') or 0) >= config.THUMB_WIDTH]
+            url = min(wide, key=lambda t: t['width'])['url'] if wide else thumbnails[-1]['url']
+        if url and self.thumbnails is not None:
+            return self.thumbnails.url_for(url, base_url)
+        return url
+
+    def _playlist_header(self, info):
+        return {
+            "is_playlist": True,
+            "title": info.get('title', 'Playlist'),
+            "platform": info.get('extractor_key', 'custom'),
+        }
+
+    def summarize_info(self, info, base_url=None):
+        if 'entries' in info:
+            # It's a playlist or multiple items
+            entries = []
+            # Handle cases where entries is a generator or list
+            raw_entries = list(info.get('entries', []))
+        
+            for idx, entry in enumerate(raw_entries):
+                if idx > 2000: break 
+                if not entry: continue
+            
+                entries.append(self._entry_summary(idx, entry, base_url))
+
+            return {
+                **self._playlist_header(info),
+                "count": len(entries),
+                "entries": entries
+            }
+    
+        # Single video
+        index = self.format_index(info)
+        return {
+            "is_playlist": False,
+            "id": info.get('id'),
+            "title": info.get('title') or 'Downify Media',
+            "view_count": info.get('view_count'),
+            "thumb": info.get('thumbnail'),
+            "duration": index.duration,
+            "platform": info.get('extractor_key'),
+            "sizes": index.sizes(),
+            "matrix": index.matrix(),
+            "video_url": index.playback_url
+        }
+
     def get_status(self, task_id):
-        return self.tasks.get(task_id)
+        task = self.tasks.get(task_id)
+        if task:
+            return task.to_dict()
+        # Owned by another worker (or by a previous run of this one)
+        return self.store.load(task_id)
+
+    def is_local(self, task_id):
+        return task_id in self.tasks
+
+    def _notify(self, task_id):
+        task = self.tasks.get(task_id)
+        status = task.status if task else None
+        if task:
+            self.store.record(task)
+        for listener in self.listeners:
+            try:
+                listener(task_id, status)
+            except Exception as e:
+                print(f"Task listener error: {e}")
+
+    def mark_queued(self, task_id, request=None):
+        task = self.tasks.create(task_id, 'queued')
+        if request is not None:
+            task.request = request.model_dump() if hasattr(request, 'model_dump') else dict(request)
+        self._notify(task_id)
+
+    def cancel(self, task_id):
+        # Queued tasks are dropped by the scheduler; running ones stop at the next progress tick
+        self.cancelled.add(task_id)
+        task = self.tasks.get(task_id)
+        if task and task.status == 'queued':
+            self.tasks.finish(task, 'cancelled')
+            self._notify(task_id)
+
+    def _target_height(self, quality):
+        # Map requested quality
+        if quality in ('4320', '3840', '2160', '1440', '1080', '720'):
+            return int(quality)
+        return 480
+
+    def _needs_upscale(self, info, target_height):
+        # Returns (should_upscale, best_height) for a target height
+        if not info or 'entries' in info:
+            return FormatIndex({}).needs_upscale(target_height)
+        return self.format_index(info).needs_upscale(target_height)
+
+    def classify_lane(self, request):
+        # Only re-encodes are CPU heavy. Uses cached metadata when the client
+        # called /api/extract first, otherwise guesses from the requested quality.
+        if request.type == 'audio' or not self.has_ffmpeg:
+            return LIGHT
+        target_height = self._target_height(request.quality)
+        info = self.metadata_cache.peek(request.url)
+        if info is None:
+            return HEAVY if target_height >= 1440 else LIGHT
+        should_upscale, _ = self._needs_upscale(info, target_height)
+        return HEAVY if should_upscale else LIGHT
+
+    def _plan_upscale(self, task_id, request):
+        # Returns (target_height, should_upscale, format) for a video request
+        target_height = self._target_height(request.quality)
+
+        # Detect Source Resolution (Fast Check)
+        should_upscale = False
+        index = None
+        try:
+            info = self.get_info(request.url)
+            if info and 'entries' not in info:
+                index = self.format_index(info)
+            should_upscale, best_height = self._needs_upscale(info, target_height)
+            if should_upscale and best_height:
+                print(f"Task {task_id}: Smart Upscaling Active ({best_height}p -> {target_height}p)")
+            elif should_upscale:
+                print(f"Task {task_id}: Force Upscaling (Unknown Source Height) -> {target_height}p")
+            else:
+                print(f"Task {task_id}: Upscale NOT needed. Best found: {best_height}p, Target: {target_height}p")
+        except Exception as e:
+            print(f"Upscale check error: {e}")
+            # On error, if high quality requested, force it?
+            if target_height >= 1440:
+                should_upscale = True
+                print(f"Task {task_id}: Error checking source, forcing upscale to {target_height}p safely.")
+        # Playlists and failed lookups have no formats to index: generic selector
+        fmt = (index or FormatIndex({})).format_selector(target_height, should_upscale)
+        return target_height, should_upscale, fmt
+
+    def _result_key(self, request, upscale):
+        # What identifies this output: source media plus everything that changes the bytes we produce
+        try:
+            info = self.get_info(request.url)
+        except Exception:
+            return None
+        if not info or not info.get('id'):
+            return None
+
+        is_playlist = bool(request.isPlaylist or request.platform == 'playlist')
+        return result_key(
+            info.get('extractor_key') or info.get('extractor'), info['id'],
+            request.type, request.quality, upscale, self.has_ffmpeg,
+            [request.playlist_start, request.playlist_end] if is_playlist else 'single',
+        )
+
+    def _apply_result(self, task, result, cache_hit):
+        task.output_type = result['output_type']
+        task.file_id = result['file_id']
+        task.files = result['files']
+        task.cache_hit = cache_hit
+        task.progress = 100
+        task.speed = task.eta = None
+        self.tasks.finish(task, 'completed')
+
+    def _wait_for_leader(self, task_id, future):
+        # Follower of an identical in-flight download; cancellable while waiting
+        while True:
+            if task_id in self.cancelled:
+                raise TaskCancelled()
+            try:
+                return future.result(timeout=0.5)
+            except FutureTimeout:
+                continue
+
+    def plan_stream(self, url, media_type, quality):
+        # Picks a single progressive format that can be piped to the client
+        # as-is. Returns None when the on-disk path is needed (merging,
+        # upscaling or audio conversion would change the bytes).
+        info = self.get_info(url)
+        if not info or 'entries' in info:
+            return None
+
+        index = self.format_index(info)
+        if media_type == 'audio':
+            chosen = index.stream_audio
+            if chosen is None:
+                return None
+        else:
+            candidates = index.progressive_http
+            if not candidates:
+                return None
+            target_height = self._target_height(quality)
+            if self.has_ffmpeg:
+                # Stream only if a progressive format reaches the requested height;
+                # otherwise the merged/upscaled disk path gives a better result.
+                tall_enough = [f for f in candidates if (f.get('height') or 0) >= target_height]
+                if not tall_enough:
+                    return None
+                chosen = min(tall_enough, key=lambda f: (f.get('height') or 0, -(f.get('tbr') or 0)))
+            else:
+                # Same choice the disk path makes without FFmpeg ('format': 'best')
+                chosen = candidates[-1]
+
+        ext = chosen.get('ext') or 'bin'
+        title = info.get('title') or info.get('id') or 'download'
+        return {
+            "url": chosen['url'],
+            "http_headers": chosen.get('http_headers') or {},
+            "filesize": chosen.get('filesize'),
+            "ext": ext,
+            "format_id": chosen.get('format_id'),
+            "filename": f"{title}.{ext}",
+        }
+
+    def open_stream(self, plan):
+        # Opens the source with yt-dlp's networking stack (cookies, proxies, impersonation).
+        # Returns (response, close) where close returns the YoutubeDL to the pool once streaming ends.
+        ydl, release = self.ydl_pool.acquire('stream')
+        try:
+            return ydl.urlopen(yt_dlp.networking.Request(plan['url'], headers=plan['http_headers'])), release
+        except Exception:
+            release()
+            raise
 
     def get_file_path(self, file_id):
-        return os.path.join(self.downloads_dir, file_id)
+        # None if file_id tries to escape downloads_dir or reach into a running task
+        root = os.path.realpath(self.downloads_dir)
+        path = os.path.realpath(os.path.join(root, file_id))
+        if path != root and path.startswith(root + os.sep) and not self.staging.contains(path):
+            return path
+        return None
 
     def process_download(self, task_id, request):
-        self.tasks[task_id] = {"status": "processing", "progress": 0}
-        
-        # specific directory for this task to avoid file conflicts and easy zipping
-        task_dir = os.path.join(self.downloads_dir, task_id)
-        os.makedirs(task_dir, exist_ok=True)
+        if task_id in self.cancelled:
+            self.cancelled.discard(task_id)
+            return
+        task = self.tasks.get(task_id) or self.tasks.create(task_id)
+        started = time.perf_counter()
+        metrics.ACTIVE_JOBS.inc()
+        try:
+            self._process_download(task, request)
+        finally:
+            metrics.ACTIVE_JOBS.dec()
+            metrics.JOB_SECONDS.observe(time.perf_counter() - started, status=task.status)
+            metrics.JOBS.inc(status=task.status)
+            if task.status == 'completed' and not task.cache_hit and task.fetched_bytes:
+                metrics.DOWNLOADED_BYTES.inc(task.fetched_bytes)
+                metrics.JOB_BYTES.observe(task.fetched_bytes)
+
+    def _process_download(self, task, request):
+        task_id = task.task_id
+        # Queue wait as seen by this task (created when it was queued)
+        task.stages = {'queue': round(max(time.time() - task.created_at, 0), 3)}
+        task.fetched_bytes = 0
+        task.status = 'processing'
+        task.progress = 0.0
+        self._notify(task_id)
+
+        # Upscale decision is part of what identifies the output, so make it up front
+        plan = None
+        if request.type != 'audio' and self.has_ffmpeg:
+            with metrics.span('plan', task):
+                plan = self._plan_upscale(task_id, request)
+
+        # Identical output already on disk (or being produced right now)?
+        key = self._result_key(request, plan[1] if plan else None)
+        leader = False
+        if key is not None:
+            cache_started = time.perf_counter()
+            try:
+                result = self.results.lookup(key)
+                while result is None:
+                    leader, future = self.results.claim(key)
+                    if leader:
+                        break
+                    print(f"Task {task_id}: waiting for identical in-flight download")
+                    # A failed leader resolves to None: try to lead ourselves
+                    result = self._wait_for_leader(task_id, future)
+                if result is not None:
+                    print(f"Task {task_id}: served from result cache ({result['file_id']})")
+                    self._apply_result(task, result, cache_hit=True)
+                    return
+            except TaskCancelled:
+                self.tasks.finish(task, 'cancelled')
+                return
+            finally:
+                metrics.record_stage('cache', time.perf_counter() - cache_started, task)
+                if task.finished:
+                    self.cancelled.discard(task_id)
+                    self._notify(task_id)
+
+        # specific directory for this task to avoid file conflicts and easy zipping;
+        # staged beside downloads_dir (or on a tmpfs for small jobs) and published by one rename
+        staged = self.staging.open(task_id, self._expected_size(request, plan) if self.staging.small_root else 0)
+        task_dir = staged.path
+        result = None
         
         try:
             # Determine Output Directory (Smart Folders)
@@ -189,260 +524,644 @@ class Downloader:
             # We'll stick to task_dir for temp processing to avoid concurrency issues, 
             # BUT we will change how we finalize.
             
+            # Per-task options on top of the pooled profile (see _ydl_profiles)
             ydl_opts = {
                 'outtmpl': os.path.join(task_dir, '%(title)s.%(ext)s'),
-                'progress_hooks': [lambda d: self._progress_hook(task_id, d)],
-                # 'quiet': True,
-                'verbose': True, 
-                'overwrites': True,
-                'ignoreerrors': True, 
-                'restrictedfilenames': True,
-                'force_ipv4': True, 
-                'ffmpeg_location': shutil.which('ffmpeg'),
+                'progress_hooks': [lambda d: self._progress_hook(task_id, d), staged.progress_hook],
+                # Final path of every video after post-processing: the task's output list
+                'post_hooks': [staged.post_hook],
             }
             print(f"Starting download for task {task_id} in {task_dir}")
             
             if request.type == 'audio':
-                ydl_opts.update({
-                    'format': 'bestaudio/best',
-                    'postprocessors': [{
-                        'key': 'FFmpegExtractAudio',
-                        'preferredcodec': 'mp3',
-                        'preferredquality': request.quality,
-                    }],
-                })
+                # Converted to mp3 after download (see _convert_audio_outputs),
+                # which copies mp3 sources and writes every bitrate in one decode
+                profile = 'audio'
             else:
                 # Video Logic
                 use_high_quality = self.has_ffmpeg
                 
                 if use_high_quality:
-                    # Map requested quality
-                    target_height = 480
-                    if request.quality == '4320': target_height = 4320
-                    elif request.quality == '3840': target_height = 3840
-                    elif request.quality == '2160': target_height = 2160
-                    elif request.quality == '1440': target_height = 1440
-                    elif request.quality == '1080': target_height = 1080
-                    elif request.quality == '720': target_height = 720
-                    
-                    # Detect Source Resolution (Fast Check)
-                    should_upscale = False
-                    try:
-                        with yt_dlp.YoutubeDL({'quiet':True, 'force_ipv4':True}) as ydl_temp:
-                             info = ydl_temp.extract_info(request.url, download=False)
-                             best_height = 0
-                             if 'formats' in info:
-                                 v_formats = [f for f in info['formats'] if f.get('height') and f.get('vcodec') != 'none']
-                                 if v_formats:
-                                     best_height = max(f['height'] for f in v_formats)
-                             
-                             if best_height > 0 and best_height < target_height:
-                                 should_upscale = True
-                                 print(f"Task {task_id}: Smart Upscaling Active ({best_height}p -> {target_height}p)")
-                             elif best_height == 0 and target_height >= 1440:
-                                 # Fallback: If we couldn't detect height (common on some extractors like Insta),
-                                 # but user wants high quality (2K/4K), assume source is lower and FORCE upscale.
-                                 should_upscale = True
-                                 print(f"Task {task_id}: Force Upscaling (Unknown Source Height) -> {target_height}p")
-                             else:
-                                 print(f"Task {task_id}: Upscale NOT needed. Best found: {best_height}p, Target: {target_height}p")
-                    except Exception as e:
-                        print(f"Upscale check error: {e}")
-                        # On error, if high quality requested, force it?
-                        if target_height >= 1440:
-                            should_upscale = True
-                            print(f"Task {task_id}: Error checking source, forcing upscale to {target_height}p safely.")
-
+                    target_height, should_upscale, fmt = plan
                     if should_upscale:
+                        # Upscale Mode: fetch the best source natively; the
+                        # segment-parallel transcoder scales it after download
                         print(f"Task {task_id}: APPLYING FFMPEG SCALE")
-                        # Upscale Mode: Re-encode video with scale filter, ensure audio is included (AAC)
-                        ydl_opts.update({
-                            'format': 'bestvideo+bestaudio/best',
-                            'merge_output_format': 'mp4',
-                            'postprocessor_args': {
-                                'ffmpeg': [
-                                    '-vf', f'scale=-2:{target_height}:flags=lanczos',
-                                    '-c:v', 'libx264',
-                                    '-preset', 'fast', # Speed up re-encoding
-                                    '-c:a', 'aac',    # Force Audio
-                                    '-b:a', '192k'
-                                ]
-                            }
-                        })
+                        profile = 'video-upscale'
                     else:
-                        # Native Mode: Try to get exact match
-                        ydl_opts.update({
-                            'format': f'bestvideo[height={target_height}]+bestaudio/bestvideo+bestaudio/best',
-                            'merge_output_format': 'mp4',
-                        })
+                        profile = 'video-native'
+                        ydl_opts['format'] = fmt
                 else:
                     # No FFmpeg? Fast fallback immediate
                     print(f"Task {task_id}: FFmpeg missing, forcing standard quality (single file).")
+                    profile = 'video-native'
                     ydl_opts['format'] = 'best'
 
 
+            playlist_entries = None
             if request.platform == 'playlist' or request.isPlaylist:
-                ydl_opts['yes_playlist'] = True
-                if request.playlist_start or request.playlist_end:
-                     # ensure 1-based index is handled correctly by yt-dlp (it expects 1-based)
-                     start = request.playlist_start if request.playlist_start else 1
-                     if request.playlist_end:
-                         ydl_opts['playlist_items'] = f"{start}-{request.playlist_end}"
-                     else:
-                         ydl_opts['playlist_items'] = f"{start}:"
+                # Entries may share a title and download side by side: number their files
+                ydl_opts['outtmpl'] = os.path.join(task_dir, '%(playlist_index)s - %(title)s.%(ext)s')
+                playlist_entries = self._selected_entries(request)
+                if playlist_entries is None:
+                    # No usable flat listing: let yt-dlp walk the playlist sequentially
+                    ydl_opts['yes_playlist'] = True
+                    if request.playlist_start or request.playlist_end:
+                         # ensure 1-based index is handled correctly by yt-dlp (it expects 1-based)
+                         start = request.playlist_start if request.playlist_start else 1
+                         if request.playlist_end:
+                             ydl_opts['playlist_items'] = f"{start}-{request.playlist_end}"
+                         else:
+                             ydl_opts['playlist_items'] = f"{start}:"
             else:
                 ydl_opts['noplaylist'] = True
 
+            # Transfer settings per source; a lease's hook reports throughput back to
+            # the tuner. Playlist entries download side by side and take one lease each.
+            info = self.metadata_cache.peek(request.url)
+            extractor = info.get('extractor_key') if info else None
+
+            def new_lease(url=None, ie_key=None):
+                return self.accelerator.lease(request.platform, ie_key or extractor, host_of(url or request.url))
+
+            lease = None
+            if playlist_entries is None:
+                lease = new_lease()
+                ydl_opts.update(lease.options)
+                ydl_opts['progress_hooks'].append(lease.progress_hook)
+
             # Execute Download
             print(f"Starting download for task {task_id}")
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.extract_info(request.url, download=True)
+            # yt-dlp's own merge/convert steps run inside this span and are also timed by _postprocessor_hook
+            ydl_opts['postprocessor_hooks'] = [lambda d: self._postprocessor_hook(task, d)]
+            try:
+                with metrics.span('download', task):
+                    self._download_with_retries(task, request, profile, ydl_opts, playlist_entries, staged, lease, new_lease)
+            finally:
+                if lease is not None:
+                    lease.release()
 
             # Check files
-            files = os.listdir(task_dir)
+            files = staged.files()
 
             # Manual Merge Fallback (If yt-dlp failed to merge)
-            if len(files) >= 2 and not (request.platform == 'playlist' or request.isPlaylist):
+            if len(files) >= 2 and not (request.platform == 'playlist' or request.isPlaylist) and request.type != 'audio':
                 print(f"Task {task_id}: Detected separate files, attempting manual merge...")
-                import subprocess
-                
-                video_files = [f for f in files if f.endswith('.mp4') or f.endswith('.webm')]
-                audio_files = [f for f in files if f.endswith('.m4a') or f.endswith('.mp3')] # Common audio formats
-                
-                if video_files and audio_files:
-                    v_file = os.path.join(task_dir, video_files[0])
-                    a_file = os.path.join(task_dir, audio_files[0])
-                    out_file = os.path.join(task_dir, "merged_output.mp4")
-                    
-                    cmd = [
-                        shutil.which('ffmpeg'),
-                        '-i', v_file,
-                        '-i', a_file,
-                        '-c:v', 'copy', # Video is likely already processed/scaled
-                        '-c:a', 'aac',  # Ensure audio is AAC
-                        '-strict', 'experimental',
-                        out_file
-                    ]
-                    
-                    try:
-                        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                        print(f"Task {task_id}: Manual merge successful.")
-                        # Remove originals
-                        os.remove(v_file)
-                        os.remove(a_file)
-                        files = ["merged_output.mp4"]
-                    except Exception as e:
-                        print(f"Manual merge failed: {e}")
+                with metrics.span('merge', task):
+                    merged = self._merge_separate_streams(task_id, task_dir, files)
+                if merged:
+                    files = [merged]
+
+            if request.type == 'audio' and self.has_ffmpeg and files:
+                with metrics.span('audio', task):
+                    files = self._convert_audio_outputs(task_id, task_dir, files, self._audio_bitrates(request.quality))
+
+            if plan and plan[1] and files:
+                with metrics.span('upscale', task):
+                    files = self._upscale_outputs(task_id, task_dir, files, plan[0])
 
-            
             # Fallback logic removed as we decide upfront based on capability
             if not files:
                  # Last ditch effort if even single file failed (unexpected)
                  raise Exception("Download failed (No files found).")
                 
             # Post-Download Organization
-            # If playlist, move task_dir to downloads/Title
-            # If single, move file to downloads/
-            
-            final_filenames = []
-            final_path = ""
+            # If playlist, task_dir becomes downloads/Title
+            # If single, task_dir becomes downloads/<task_id> holding the file
             
+            finalize_started = time.perf_counter()
+            self._remove_manifest(task_dir)
+
             if request.isPlaylist or request.platform == 'playlist':
-                 # Get playlist title from first file or by metadata? 
-                 # Usually we can get it from extraction, but we skipped it here.
-                 # Let's naming convention: "Playlist_<task_id>" if we can't find better, 
-                 # or try to extract title from one of the files info json if we saved it?
-                 # Simpler: Use "Playlist_{First_File_Name_Base}" or just let the user see the folder.
-                 # Updated Requirement: "one new folder with good playlist name"
-                 
-                 # Let's attempt to retrieve playlist title via a quick extract if costly? No.
-                 # Let's use the task_id as unique folder for now but rename it if possible.
-                 # Actually, let's look at the filenames.
-                 
-                 # Use title if available
+                 # Use title if available. Another download of the same title gets
+                 # its own folder ("Title_2") rather than merging into this one.
                  import re
                  safe_title = re.sub(r'[<>:"/\\|?*]', '_', request.title) if request.title else f"Playlist_{task_id[:8]}"
-                 final_folder_name = safe_title
-                 
-                 final_playlist_dir = os.path.join(self.downloads_dir, final_folder_name)
-                 if os.path.exists(final_playlist_dir): 
-                     # If exists, maybe append task_id to avoid collision or just merge?
-                     # User wants "one new folder", implying overwrite or merge.
-                     # Let's clean it if it exists to be fresh? Or just merge.
-                     # "Clean it" might delete previous downloads. Merge is safer but might leave old files.
-                     # Let's remove if it exists to ensure exact match of current request? 
-                     # No, that's dangerous. Let's start fresh.
-                     pass 
-                 else:
-                     os.makedirs(final_playlist_dir, exist_ok=True)
-                 
-                 # Move contents of task_dir to final_playlist_dir
-                 # task_dir has the files
-                 for file in os.listdir(task_dir):
-                     shutil.move(os.path.join(task_dir, file), os.path.join(final_playlist_dir, file))
-                 
-                 os.rmdir(task_dir)
-                 
-                 final_filenames = os.listdir(final_playlist_dir)
-                 final_path = final_folder_name
-                 
-                 # Update task to reflect folder
-                 self.tasks[task_id]['output_type'] = 'folder'
-                 self.tasks[task_id]['file_id'] = final_folder_name
-                 
+                 task.output_type = 'folder'
+                 task.file_id = self.staging.publish(staged, safe_title)
             else:
-                # Single file behavior (keep existing)
-                for file in files:
-                    src = os.path.join(task_dir, file)
-                    dest = os.path.join(self.downloads_dir, file)
-                    if os.path.exists(dest): os.remove(dest)
-                    os.rename(src, dest)
-                    final_filenames.append(file)
-                os.rmdir(task_dir)
-                self.tasks[task_id]['output_type'] = 'file'
-                self.tasks[task_id]['file_id'] = final_filenames[0]
-
-            self.tasks[task_id]['status'] = 'completed'
-            self.tasks[task_id]['files'] = final_filenames
-            self.tasks[task_id]['progress'] = 100
+                # The task dir becomes the file's folder: original names, no collisions
+                folder = self.staging.publish(staged, task_id)
+                task.output_type = 'file'
+                task.file_id = f"{folder}/{files[0]}"
+
+            result = {"output_type": task.output_type, "file_id": task.file_id, "files": files}
+            self.results.store(key, task_id, **result)
+            metrics.record_stage('finalize', time.perf_counter() - finalize_started, task)
+            self._apply_result(task, result, cache_hit=False)
                 
+        except TaskCancelled:
+            print(f"Task {task_id}: cancelled")
+            task.progress = 0.0
+            self.tasks.finish(task, 'cancelled')
+            self.staging.discard(staged)
         except Exception as e:
-            self.tasks[task_id] = {"status": "error", "error": str(e)}
-            # Cleanup on error
-            if os.path.exists(task_dir):
-                shutil.rmtree(task_dir)
+            if self.suspending:
+                # Shutdown: keep task_dir and its manifest, the next start resumes from them
+                print(f"Task {task_id}: interrupted, partial data kept in {task_dir}")
+                task.status = 'interrupted'
+                task.speed = 0
+            else:
+                self.tasks.finish(task, 'error', str(e))
+                # Cleanup on error
+                self.staging.discard(staged)
+        finally:
+            if leader:
+                self.results.release(key, result)
+            self.cancelled.discard(task_id)
+            self._notify(task_id)
+
+    def _postprocessor_hook(self, task, d):
+        # Times yt-dlp's post-processors (FFmpegMerger etc.) as 'pp:<name>' stages
+        key = f"pp:{d.get('postprocessor')}"
+        # Playlist entries post-process concurrently, one per thread
+        slot = (task.task_id, key, threading.get_ident())
+        with self._lock:
+            if d['status'] == 'started':
+                self._pp_started[slot] = time.perf_counter()
+            elif d['status'] == 'finished':
+                started = self._pp_started.pop(slot, None)
+                if started is not None:
+                    metrics.record_stage(key, time.perf_counter() - started, task)
+
+    def _check_cancelled(self, task_id):
+        if task_id in self.cancelled:
+            raise TaskCancelled()
+        if self.suspending:
+            raise TaskInterrupted()
+
+    # --- Resume / recovery ---------------------------------------------------
 
+    def _read_manifest(self, task_dir):
+        try:
+            with open(os.path.join(task_dir, MANIFEST)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_manifest(self, task_dir, task, request, **fields):
+        # Written atomically so a crash never leaves a torn manifest behind
+        manifest = self._read_manifest(task_dir) or {"task_id": task.task_id, "created_at": time.time()}
+        manifest["request"] = request.model_dump() if hasattr(request, 'model_dump') else dict(request)
+        manifest.update(fields, updated_at=time.time())
+        tmp = os.path.join(task_dir, MANIFEST + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp, os.path.join(task_dir, MANIFEST))
+        return manifest
+
+    def _remove_manifest(self, task_dir):
+        try:
+            os.remove(os.path.join(task_dir, MANIFEST))
+        except FileNotFoundError:
+            pass
+
+    def _is_partial(self, name):
+        return name.endswith(('.part', '.ytdl')) or '.part-Frag' in name
+
+    def _partial_files(self, task_dir):
+        return [f for f in os.listdir(task_dir) if self._is_partial(f)]
+
+    def _backoff_sleep(self, task_id, delay):
+        deadline = time.monotonic() + delay
+        while True:
+            self._check_cancelled(task_id)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, 0.5))
+
+    def _download_with_retries(self, task, request, profile, ydl_opts, playlist_entries, staged, lease, new_lease):
+        # Runs yt-dlp until every file is complete, retrying with exponential
+        # backoff. Retries (and a resumed task after a restart) continue the
+        # .part files and skip finished ones, so no byte is fetched twice.
+        task_id = task.task_id
+        task_dir = staged.path
+        manifest = self._read_manifest(task_dir) or {}
+        done_files = manifest.get('files') or []
+        for name in done_files:
+            staged.record(os.path.join(task_dir, name))
+        if manifest.get('phase') == 'downloaded' and done_files and all(
+                os.path.exists(os.path.join(task_dir, f)) for f in done_files):
+            print(f"Task {task_id}: resuming after download, {len(done_files)} file(s) already complete")
+            return
+        if manifest:
+            print(f"Task {task_id}: resuming from attempt {manifest.get('attempts', 0)} ({len(self._partial_files(task_dir))} partial file(s))")
+
+        attempts = manifest.get('attempts', 0)
+        pending = playlist_entries
+        error = None
+        for retry in range(config.DOWNLOAD_RETRIES + 1):
+            attempts += 1
+            self._write_manifest(task_dir, task, request, attempts=attempts, phase='downloading')
+            error = None
+            try:
+                if pending is not None:
+                    pending = self._download_playlist_entries(task_id, profile, ydl_opts, pending, new_lease)
+                    ok = not pending
+                else:
+                    with self.ydl_pool.checkout(profile, **ydl_opts) as ydl:
+                        # ignoreerrors hides failures: judge by what landed on disk
+                        ok = self._download_with_info(ydl, request.url) is not None and ydl._download_retcode == 0
+                    ok = ok and bool(staged.files())
+            except yt_dlp.utils.DownloadCancelled:
+                raise
+            except Exception as e:
+                ok, error = False, e
+            if ok and not self._partial_files(task_dir):
+                self._write_manifest(task_dir, task, request, phase='downloaded', files=staged.files())
+                return
+            if retry == config.DOWNLOAD_RETRIES:
+                break
+            if lease is not None and self._partial_files(task_dir):
+                # Transfer cut off: fewer parallel fragment requests for the retry
+                # (and for later downloads from this host)
+                lease.failed()
+                ydl_opts.update(lease.options)
+            delay = min(config.DOWNLOAD_RETRY_BACKOFF * 2 ** retry, config.DOWNLOAD_RETRY_BACKOFF_MAX)
+            reason = f": {error}" if error else ""
+            print(f"Task {task_id}: download incomplete after attempt {attempts}{reason}; retrying in {delay:g}s")
+            self._backoff_sleep(task_id, delay)
 
+        if error is not None:
+            raise error
+        # Out of retries. A playlist keeps the entries that finished; leftovers are dropped.
+        for name in self._partial_files(task_dir):
+            os.remove(os.path.join(task_dir, name))
 
+    def suspend(self):
+        # Graceful shutdown: running downloads stop at their next progress tick
+        # and every unfinished task is journaled as interrupted for recovery.
+        self.suspending = True
+        for task in self.tasks.active():
+            task.status = 'interrupted'
+            task.speed = 0
+            self._notify(task.task_id)
+
+    def recover(self, max_age):
+        # Unfinished work left by stopped workers (or a previous run of this
+        # one): [(task_id, request dict)] claimed by this worker for re-enqueueing.
+        recovered = {}
+        for task_id in self.store.interrupted(max_age):
+            request = self.store.load_request(task_id)
+            if request and self.store.claim_interrupted(task_id):
+                recovered[task_id] = request
+
+        # Task dirs left on disk: resume those the journal has no record of,
+        # drop those whose task has finished or was given up. Task dirs directly
+        # in downloads_dir predate staging and are moved into it to resume.
+        # Tasks still running here or on a live worker are left alone.
+        live = {task_id for task_id, _, _, alive in self.store.unfinished() if alive}
+        for root in self.staging.roots() + [self.downloads_dir]:
+            for name in os.listdir(root):
+                task_dir = os.path.join(root, name)
+                if not os.path.isdir(task_dir):
+                    continue
+                manifest = self._read_manifest(task_dir)
+                if manifest is None:
+                    continue
+                if name not in recovered and (self.is_local(name) or name in live):
+                    continue
+                if name not in recovered:
+                    status = self.store.load(name)
+                    fresh = time.time() - manifest.get('updated_at', 0) <= max_age
+                    if status is None and fresh and manifest.get('request'):
+                        if self.store.adopt(name, manifest['request']):
+                            recovered[name] = manifest['request']
+                    elif status is None or status.get('status') in FINISHED_STATES:
+                        print(f"Recovery: removing leftover data of task {name}")
+                        shutil.rmtree(task_dir, ignore_errors=True)
+                        continue
+                if root == self.downloads_dir and name in recovered and self.staging.find(name) is None:
+                    shutil.move(task_dir, os.path.join(self.staging.root, name))
+        return list(recovered.items())
+
+    def _expected_size(self, request, plan):
+        # Peak bytes a job needs while staged (downloads plus outputs), 0 when
+        # unknown. Playlists and upscales are never small enough to count.
+        if request.isPlaylist or request.platform == 'playlist' or (plan and plan[1]):
+            return 0
+        info = self.metadata_cache.peek(request.url)
+        if not info:
+            return 0
+        index = self.format_index(info)
+        if request.type == 'audio':
+            if not index.best_audio_size:
+                return 0
+            mp3 = sum(kbps * 1000 / 8 * (index.duration or 0) for kbps in self._audio_bitrates(request.quality))
+            return int(index.best_audio_size + mp3)
+        # Separate video and audio downloads, then the merged file
+        return 2 * index.total_size(plan[0]) if plan else 0
+
+    def _upscale_outputs(self, task_id, task_dir, files, target_height):
+        # Re-encodes every downloaded video in place; returns the new file list
+        task = self.tasks.get(task_id)
+        out = []
+        for name in files:
+            src = os.path.join(task_dir, name)
+            if not name.endswith(('.mp4', '.webm', '.mkv', '.mov')):
+                out.append(name)
+                continue
+            task.status = 'processing'
+            task.current_file = name
+            self._notify(task_id)
+            final = os.path.splitext(name)[0] + '.mp4'
+            tmp = os.path.join(task_dir, f".upscale_{final}")
+            try:
+                self.transcoder.upscale(src, tmp, target_height, check=lambda: self._check_cancelled(task_id))
+            except yt_dlp.utils.DownloadCancelled:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+            os.remove(src)
+            os.replace(tmp, os.path.join(task_dir, final))
+            out.append(final)
+        return out
+
+    def _merge_separate_streams(self, task_id, task_dir, files):
+        # Picks the video and audio downloads by their streams (by extension
+        # without ffprobe) and muxes them; returns the merged name or None
+        video_file = audio_file = None
+        for name in sorted(files):
+            info = media_probe.probe(os.path.join(task_dir, name))
+            if info is not None:
+                has_video = bool(media_probe.streams(info, 'video'))
+                has_audio = bool(media_probe.streams(info, 'audio'))
+            else:
+                has_video = name.endswith(('.mp4', '.webm'))
+                has_audio = name.endswith(('.m4a', '.mp3', '.opus', '.ogg'))
+            if has_video and video_file is None:
+                video_file = name
+            elif has_audio and not has_video and audio_file is None:
+                audio_file = name
+        if not (video_file and audio_file):
+            return None
+
+        v_file = os.path.join(task_dir, video_file)
+        a_file = os.path.join(task_dir, audio_file)
+        out_file = os.path.join(task_dir, "merged_output.mp4")
+        try:
+            self.transcoder.merge(v_file, a_file, out_file, check=lambda: self._check_cancelled(task_id))
+        except yt_dlp.utils.DownloadCancelled:
+            raise
+        except Exception as e:
+            print(f"Manual merge failed: {e}")
+            return None
+        print(f"Task {task_id}: Manual merge successful.")
+        # Remove originals
+        os.remove(v_file)
+        os.remove(a_file)
+        return "merged_output.mp4"
+
+    def _audio_bitrates(self, quality):
+        # "128", "320" or several at once: "128,320"
+        rates = []
+        for part in str(quality or '').split(','):
+            try:
+                rate = int(part.strip())
+            except ValueError:
+                continue
+            if 32 <= rate <= 320 and rate not in rates:
+                rates.append(rate)
+        return rates or [192]
+
+    def _convert_audio_outputs(self, task_id, task_dir, files, bitrates):
+        # One mp3 per requested bitrate for every downloaded file; returns the new file list
+        out = []
+        for name in files:
+            src = os.path.join(task_dir, name)
+            base = os.path.splitext(name)[0]
+            if len(bitrates) == 1:
+                targets = [(f"{base}.mp3", bitrates[0])]
+            else:
+                targets = [(f"{base}_{kbps}k.mp3", kbps) for kbps in bitrates]
+            # Temporary names so a source that is already Title.mp3 is not overwritten while read
+            staged = [(os.path.join(task_dir, f".audio_{target}"), kbps) for target, kbps in targets]
+            try:
+                self.transcoder.audio_variants(src, staged, check=lambda: self._check_cancelled(task_id))
+            except Exception:
+                for path, _ in staged:
+                    if os.path.exists(path):
+                        os.remove(path)
+                raise
+            os.remove(src)
+            for (target, _), (path, _) in zip(targets, staged):
+                os.replace(path, os.path.join(task_dir, target))
+                out.append(target)
+        return out
+
+    def _download_with_info(self, ydl, url):
+        # Reuse the cached extraction instead of resolving the URL again.
+        # process_ie_result mutates its input, so work on a private copy.
+        info = None
+        try:
+            cached = self.get_info(url)
+            if cached:
+                info = copy.deepcopy(cached)
+        except Exception as e:
+            print(f"Cached info unavailable for {url}: {e}")
+
+        if info is None:
+            return ydl.extract_info(url, download=True)
+        return ydl.process_ie_result(info, download=True)
+
+    def _selected_entries(self, request):
+        # [(playlist_index, flat_entry)] within playlist_start/playlist_end, or None
+        try:
+            info = self.get_info(request.url)
+        except Exception as e:
+            print(f"Playlist listing unavailable: {e}")
+            return None
+        if not info or info.get('entries') is None:
+            return None
+
+        start = request.playlist_start or 1
+        end = request.playlist_end or len(info['entries'])
+        return [
+            (idx, entry) for idx, entry in enumerate(info['entries'], start=1)
+            if start <= idx <= end and entry
+        ]
+
+    def _download_playlist_entries(self, task_id, profile, ydl_opts, entries, new_lease):
+        # Fan entries out to a small pool; every entry is its own yt-dlp run
+        # writing into the shared task dir.
+        # Returns the entries that failed, so a retry can run just those.
+        task = self.tasks.get(task_id)
+        if task.entries is None:
+            task.entries = {str(idx): EntryState(entry.get('title')) for idx, entry in entries}
+            task.playlist_total = len(entries)
+            task.playlist_index = 0
+        else:
+            for idx, entry in entries:
+                task.entries[str(idx)] = EntryState(entry.get('title'))
+
+        last_index = max(map(int, task.entries), default=0)
+
+        def run(idx, entry):
+            state = task.entries[str(idx)]
+            if task_id in self.cancelled:
+                state.state = 'cancelled'
+                raise TaskCancelled()
+            # Each entry's connections count against the host on their own
+            lease = new_lease(entry.get('url'), entry.get('ie_key'))
+            opts = dict(ydl_opts, **lease.options)
+            opts['noplaylist'] = True
+            # Entry-level progress in place of the task-level hook; the rest (produced files) stay
+            opts['progress_hooks'] = [lambda d: self._progress_hook(task_id, d, entry_key=str(idx))] + ydl_opts['progress_hooks'][1:] + [lease.progress_hook]
+            # Processed on its own, the entry only knows its playlist position (for
+            # the filename, padded like yt-dlp's own playlist walk) if told
+            extra = {'playlist': None, 'playlist_index': idx, '__last_playlist_index': last_index}
+            state.state = 'downloading'
+            try:
+                with self.ydl_pool.checkout(profile, **opts) as ydl:
+                    result = ydl.process_ie_result(copy.deepcopy(entry), download=True, extra_info=extra)
+                    # ignoreerrors hides failures (a transfer cut off still returns the info)
+                    ok = result is not None and ydl._download_retcode == 0
+                if not ok and lease.transferring:
+                    # Transfer cut off: back off for the retry and for later entries
+                    lease.failed()
+            except yt_dlp.utils.DownloadCancelled:
+                state.state = 'cancelled'
+                raise
+            except Exception as e:
+                state.state = 'error'
+                state.error = str(e)
+                if lease.transferring:
+                    lease.failed()
+                return
+            finally:
+                lease.release()
+            if not ok:
+                # Pending again: the retry resumes its .part file
+                state.state = 'error'
+            else:
+                state.state = 'done'
+                state.progress = 100
+                state.speed = 0
+            with self._lock:
+                task.playlist_index = sum(1 for e in task.entries.values() if e.state in ('done', 'error'))
+                self._aggregate_playlist(task)
+            self._notify(task_id)
+
+        workers = max(1, min(config.PLAYLIST_WORKERS, len(entries)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"playlist-{task_id[:8]}") as pool:
+            futures = {pool.submit(run, idx, entry): idx for idx, entry in entries}
+            for future in as_completed(futures):
+                error = None if future.cancelled() else future.exception()
+                if isinstance(error, TaskCancelled):
+                    self.cancelled.add(task_id)  # stops the siblings at their next tick
+                    for f in futures:
+                        f.cancel()
+                elif error is not None and not isinstance(error, TaskInterrupted):
+                    # Failed outside the download itself: report it and retry the entry
+                    print(f"Task {task_id}: entry {futures[future]} failed: {error!r}")
+                    state = task.entries[str(futures[future])]
+                    state.state = 'error'
+                    state.error = str(error)
+                    state.speed = 0
+                    with self._lock:
+                        self._aggregate_playlist(task)
+                    self._notify(task_id)
+            if task_id in self.cancelled:
+                raise TaskCancelled()
+            if self.suspending:
+                raise TaskInterrupted()
+        return [(idx, entry) for idx, entry in entries if task.entries[str(idx)].state == 'error']
+
+    def _aggregate_playlist(self, task):
+        # Callers must hold self._lock
+        entries = task.entries.values()
+        total = len(task.entries) or 1
+        task.progress = round(sum(e.progress for e in entries) / total, 1)
+        task.speed = sum(e.speed for e in entries if e.state == 'downloading')
+        task.downloaded_bytes = sum(e.downloaded_bytes for e in entries)
+        remaining = sum(max(e.total_bytes - e.downloaded_bytes, 0) for e in entries if e.state in ('queued', 'downloading'))
+        task.eta = int(remaining / task.speed) if task.speed else None
+
+    def _progress_hook(self, task_id, d, entry_key=None):
+        # Runs on every downloaded chunk: keep it cheap. Intermediate
+        # 'downloading' ticks are dropped unless PROGRESS_HOOK_INTERVAL passed
+        # (per playlist entry, which download side by side); 'finished' and
+        # 'error' always go through.
+        if task_id in self.cancelled:
+            raise TaskCancelled()
+        if self.suspending:
+            raise TaskInterrupted()
+
+        task = self.tasks.get(task_id)
+        if task is None:
+            return
+        clock = task.entries[entry_key] if entry_key is not None else task
+        now = time.monotonic()
+        if d['status'] == 'downloading' and now - clock.last_hook < config.PROGRESS_HOOK_INTERVAL:
+            return
+        clock.last_hook = now
+
+        if d['status'] == 'finished':
+            # downloaded_bytes shows the current file only; the metrics want
+            # the job's total (video and audio of a merge, every entry)
+            with self._lock:
+                task.fetched_bytes += d.get('total_bytes') or d.get('downloaded_bytes') or 0
+
+        if entry_key is not None:
+            return self._entry_progress_hook(task, entry_key, d)
 
-    def _progress_hook(self, task_id, d):
         if d['status'] == 'downloading':
-            p = d.get('_percent_str', '0%').strip().replace('%','')
-            # Remove ANSI colors if present
-            import re
-            p = re.sub(r'\x1b[[0-9;]*m', '', p)
-            
-            # Extract Speed and ETA
-            speed = d.get('speed', 0) # bytes/s
-            eta = d.get('eta', 0) # seconds
-            filename = os.path.basename(d.get('filename', 'Unknown'))
-            
-            # Playlist Info
-            info = d.get('info_dict', {})
+            done = d.get('downloaded_bytes') or 0
+            total = d.get('total_bytes') or d.get('total_bytes_estimate') or 0
+
+            task.status = 'processing' # Keep status as processing for UI
+            if total:
+                task.progress = round(done * 100 / total, 1)
+            task.downloaded_bytes = done
+            task.total_bytes = total or None
+            task.speed = d.get('speed') or 0 # bytes/s
+            task.eta = d.get('eta') or 0 # seconds
+            task.current_file = os.path.basename(d.get('filename', 'Unknown'))
+
+            # Update Playlist Progress
+            info = d.get('info_dict') or {}
             playlist_index = info.get('playlist_index')
             n_entries = info.get('n_entries')
-            
-            self.tasks[task_id]['status'] = 'processing' # Keep status as processing for UI
-            self.tasks[task_id]['progress'] = float(p)
-            self.tasks[task_id]['speed'] = speed
-            self.tasks[task_id]['eta'] = eta
-            self.tasks[task_id]['current_file'] = filename
-            
-            # Update Playlist Progress
             if playlist_index and n_entries:
-                 self.tasks[task_id]['playlist_index'] = playlist_index
-                 self.tasks[task_id]['playlist_total'] = n_entries
-            
+                 task.playlist_index = playlist_index
+                 task.playlist_total = n_entries
+
         elif d['status'] == 'finished':
-            self.tasks[task_id]['progress'] = 100
-            self.tasks[task_id]['status'] = 'processing' # Post-processing starts logic
+            task.progress = 100
+            task.downloaded_bytes = d.get('total_bytes') or d.get('downloaded_bytes') or task.downloaded_bytes
+            task.status = 'processing' # Post-processing starts logic
+
+        task.updated_at = time.time()
+        self._notify(task_id)
+
+    def _entry_progress_hook(self, task, entry_key, d):
+        entry = task.entries[entry_key]
+        if d['status'] == 'downloading':
+            done = d.get('downloaded_bytes') or 0
+            total = d.get('total_bytes') or d.get('total_bytes_estimate') or 0
+            entry.downloaded_bytes = done
+            entry.total_bytes = total
+            entry.speed = d.get('speed') or 0
+            if total:
+                entry.progress = round(done * 100 / total, 1)
+            entry.file = os.path.basename(d.get('filename', ''))
+            task.current_file = entry.file
+        elif d['status'] == 'finished':
+            # Final size even when every 'downloading' tick was throttled away
+            size = d.get('total_bytes') or d.get('downloaded_bytes')
+            if not size and d.get('filename'):
+                try:
+                    size = os.path.getsize(d['filename'])
+                except OSError:
+                    size = 0
+            if size:
+                entry.downloaded_bytes = entry.total_bytes = size
+            entry.progress = 100
+            entry.speed = 0
+
+        with self._lock:
+            task.status = 'processing'
+            self._aggregate_playlist(task)
+        task.updated_at = time.time()
+        self._notify(task.task_id)
@@ -0,0 +1,164 @@
+import mimetypes
+import os
+import re
+import zipfile
+from urllib.parse import quote
+
+from fastapi.responses import Response, StreamingResponse
+
+CHUNK_SIZE = 256 * 1024
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def content_disposition(filename):
+    ascii_name = filename.encode('ascii', 'replace').decode().replace('"', '_')
+    return f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(filename)}"
+
+
+def etag_for(stat):
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def _etag_matches(header, etag):
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    # Weak comparison is fine for GET
+    tags = [t.strip().removeprefix('W/') for t in header.split(',')]
+    return etag in tags
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _parse_range(header, size):
+    # Single byte range -> (start, end) inclusive, 'invalid' if unsatisfiable,
+    # None to ignore the header (absent, malformed or multi-range)
+    match = _RANGE_RE.match(header.strip()) if header else None
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: last N bytes
+        length = int(last)
+        if length == 0:
+            return 'invalid'
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        return 'invalid'
+    return start, min(end, size - 1)
+
+
+def file_response(request, path, filename=None):
+    # FileResponse replacement with ETag/If-None-Match and single-range
+    # (resume) support, independent of the installed Starlette version.
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = etag_for(stat)
+    # Typed like FileResponse did, so browsers can play or preview it inline
+    media_type = mimetypes.guess_type(filename or path)[0] or "application/octet-stream"
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, max-age=3600",
+        "Content-Disposition": content_disposition(filename or os.path.basename(path)),
+    }
+
+    if _etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=headers)
+
+    byte_range = _parse_range(request.headers.get('range'), size)
+    if_range = request.headers.get('if-range')
+    if byte_range is not None and if_range and if_range.strip() != etag:
+        # File changed since the client's partial copy: send it whole
+        byte_range = None
+
+    if byte_range == 'invalid':
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(_read_range(path, 0, size), media_type=media_type, headers=headers)
+
+    start, end = byte_range
+    length = end - start + 1
+    headers["Content-Length"] = str(length)
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return StreamingResponse(_read_range(path, start, length), status_code=206, media_type=media_type, headers=headers)
+
+
+class _ChunkSink:
+    # Write-only file object that collects what zipfile writes so the
+    # generator can hand it to the client piece by piece
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def _iter_zip(folder, names):
+    sink = _ChunkSink()
+    # Stored (no compression): media is already compressed and the CPU cost
+    # would dominate. zipfile falls back to data descriptors on an unseekable sink.
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for name in names:
+            path = os.path.join(folder, name)
+            info = zipfile.ZipInfo.from_file(path, arcname=name)
+            info.compress_type = zipfile.ZIP_STORED
+            with open(path, 'rb') as src, zf.open(info, 'w', force_zip64=True) as dest:
+                while True:
+                    chunk = src.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    data = sink.drain()
+    if data:
+        yield data
+
+
+def zip_response(request, folder, archive_name):
+    # Playlist folder as one streamed ZIP, built on the fly with no temp file
+    names = sorted(
+        entry.name for entry in os.scandir(folder)
+        if entry.is_file() and not entry.name.endswith('.part')
+    )
+    stats = [os.stat(os.path.join(folder, n)) for n in names]
+    etag = '"zip-%x-%x"' % (sum(s.st_size for s in stats), max((s.st_mtime_ns for s in stats), default=0) ^ len(names))
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "private, max-age=3600",
+        "Content-Disposition": content_disposition(f"{archive_name}.zip"),
+    }
+    if _etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=headers)
+    return StreamingResponse(_iter_zip(folder, names), media_type="application/zip", headers=headers)
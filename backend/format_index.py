@@ -0,0 +1,158 @@
+def estimate_size(f, duration):
+    # Bytes for one format: exact size, yt-dlp's estimate, or bitrate x duration
+    if f.get('filesize'): return f['filesize']
+    if f.get('filesize_approx'): return f['filesize_approx']
+    # Use Total Bitrate (tbr) if available
+    if f.get('tbr') and duration: return int(f['tbr'] * 1000 / 8 * duration)
+    # Use Video+Audio Bitrate if available
+    if f.get('vbr') and duration:
+        vbr = f['vbr']
+        abr = f.get('abr', 128) # Default audio 128k
+        return int((vbr + abr) * 1000 / 8 * duration)
+    return 0
+
+
+def _is_http(f):
+    return bool(f.get('url')) and (f.get('protocol') or 'https') in ('http', 'https')
+
+
+class FormatIndex:
+    # Everything the service needs from an info dict's formats, built in one
+    # pass and shared by the size summary, the download format string, the
+    # upscale decision and stream-through planning. Read-only once built.
+
+    __slots__ = (
+        'duration', 'best_height', 'video', 'best_audio', 'best_audio_size',
+        'stream_audio', 'progressive_http', 'playback_url',
+    )
+
+    def __init__(self, info):
+        formats = info.get('formats') or [info]
+        duration = info.get('duration', 0)
+        self.duration = duration
+        self.best_height = 0
+        self.video = {}  # height -> (size, format) of the largest video format at that height
+        self.best_audio = None  # audio-only format with the highest abr
+        self.stream_audio = None  # same, restricted to plain http(s)
+        self.progressive_http = []  # http(s) formats with audio and video, in yt-dlp order
+        playback = None
+
+        best_abr = stream_abr = -1
+        for f in formats:
+            vcodec = f.get('vcodec')
+            acodec = f.get('acodec')
+            height = f.get('height')
+            if vcodec == 'none':
+                if acodec == 'none':
+                    continue
+                abr = f.get('abr', 0) or 0
+                if abr > best_abr:
+                    self.best_audio, best_abr = f, abr
+                if _is_http(f):
+                    rate = f.get('abr') or f.get('tbr') or 0
+                    if rate > stream_abr:
+                        self.stream_audio, stream_abr = f, rate
+                continue
+
+            if height:
+                if height > self.best_height:
+                    self.best_height = height
+                size = estimate_size(f, duration)
+                current = self.video.get(height)
+                if current is None or size > current[0]:
+                    self.video[height] = (size, f)
+            if acodec != 'none':
+                if _is_http(f):
+                    self.progressive_http.append(f)
+                if f.get('ext') == 'mp4' and f.get('url'):
+                    playback = f['url']  # the last one is usually the highest quality
+
+        self.best_audio_size = estimate_size(self.best_audio, duration) if self.best_audio else 0
+        self.playback_url = info.get('url') or playback
+
+    def __deepcopy__(self, memo):
+        # Immutable: copies of the info dict (yt-dlp's process_ie_result) share it
+        return self
+
+    def total_size(self, height):
+        # Video at `height` plus the audio it gets merged with; 0 when unknown
+        entry = self.video.get(height)
+        if entry is None:
+            return 0
+        size, f = entry
+        if size <= 0:
+            return 0
+        return size if f.get('acodec') != 'none' else size + self.best_audio_size
+
+    def sizes(self):
+        # {quality: bytes} as the client shows it: video heights, then 128/320 kbps audio
+        sizes = {}
+        for height in sorted(self.video):
+            total = self.total_size(height)
+            if total > 0:
+                sizes[str(height)] = total
+
+        duration = self.duration
+        if duration:
+            sizes['128'] = int(128 * 1000 / 8 * duration)
+            sizes['320'] = int(320 * 1000 / 8 * duration)
+
+        # Special Case: If we have NO sizes but valid duration (e.g. some Instagram cases with no heights parsed?)
+        # We assume 1080p equivalent exists.
+        if not sizes and duration:
+            sizes['1080'] = int(2000 * 1000 / 8 * duration)
+        return sizes
+
+    def matrix(self):
+        # Per-height size and codec details, plus the audio stream merged into video-only heights
+        video = {}
+        for height in sorted(self.video):
+            size, f = self.video[height]
+            video[str(height)] = {
+                "format_id": f.get('format_id'),
+                "size": self.total_size(height) or None,
+                "vcodec": f.get('vcodec'),
+                "acodec": f.get('acodec') if f.get('acodec') != 'none' else None,
+                "ext": f.get('ext'),
+                "fps": f.get('fps'),
+                "protocol": f.get('protocol'),
+                "progressive": f.get('acodec') != 'none',
+            }
+        audio = None
+        if self.best_audio:
+            a = self.best_audio
+            audio = {
+                "format_id": a.get('format_id'),
+                "size": self.best_audio_size or None,
+                "acodec": a.get('acodec'),
+                "abr": a.get('abr'),
+                "ext": a.get('ext'),
+            }
+        return {"video": video, "audio": audio}
+
+    def needs_upscale(self, target_height):
+        # Returns (should_upscale, best_height) for a target height
+        best_height = self.best_height
+        if best_height > 0 and best_height < target_height:
+            return True, best_height
+        if best_height == 0 and target_height >= 1440:
+            # Fallback: If we couldn't detect height (common on some extractors like Insta),
+            # but user wants high quality (2K/4K), assume source is lower and FORCE upscale.
+            return True, best_height
+        return False, best_height
+
+    def format_selector(self, target_height, upscale):
+        # yt-dlp format string for a video download with FFmpeg available
+        if upscale:
+            return 'bestvideo+bestaudio/best'
+        generic = f'bestvideo[height={target_height}]+bestaudio/bestvideo+bestaudio/best'
+        entry = self.video.get(target_height)
+        if entry is None or not entry[1].get('format_id'):
+            return generic
+        f = entry[1]
+        fid = f['format_id']
+        if f.get('acodec') != 'none':
+            return f'{fid}/{generic}'
+        if self.best_audio and self.best_audio.get('format_id'):
+            return f"{fid}+{self.best_audio['format_id']}/{fid}+bestaudio/{generic}"
+        return f'{fid}+bestaudio/{generic}'
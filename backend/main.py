@@ -1,12 +1,26 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse, Response
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
+import asyncio
+import json
 import os
+import threading
+import time
 import uuid
+import config
+import metrics
+from bounded_executor import BoundedExecutor, ExecutorSaturated, DeadlineExceeded
 from downloader import Downloader
+from scheduler import DownloadScheduler, LIGHT, HEAVY, host_of
+from progress_bus import ProgressBroker, Subscription
+from metadata_cache import normalize_url
+from file_serving import file_response, zip_response, content_disposition
+from stream_relay import StreamRelay
+from batches import BatchPrefetcher, BatchRegistry, plan_batch, summarize
+from thumbnails import ThumbnailError
 
 app = FastAPI(title="Downify API")
 
@@ -20,6 +34,59 @@ app.add_middleware(
 )
 
 downloader_service = Downloader()
+download_scheduler = DownloadScheduler(
+    {LIGHT: config.DOWNLOAD_LIGHT_WORKERS, HEAVY: config.DOWNLOAD_HEAVY_WORKERS},
+    per_host_limit=config.DOWNLOAD_PER_HOST_LIMIT,
+    on_cancel=downloader_service.cancel,
+)
+extract_executor = BoundedExecutor(config.EXTRACT_WORKERS, config.EXTRACT_QUEUE_DEPTH, name="extract")
+
+def task_snapshot(task_id):
+    status = downloader_service.get_status(task_id)
+    if not status:
+        return None
+    queue_info = download_scheduler.describe(task_id)
+    return {**status, **queue_info} if queue_info else dict(status)
+
+batch_registry = BatchRegistry(downloader_service.store, ttl=config.FINISHED_TASK_TTL)
+batch_prefetcher = BatchPrefetcher(
+    extract_executor, downloader_service.get_info, downloader_service.metadata_cache.peek,
+    config.BATCH_PREFETCH_CONCURRENCY, config.EXTRACT_TIMEOUT,
+)
+
+progress_broker = ProgressBroker(task_snapshot, interval=config.PROGRESS_PUSH_INTERVAL, is_local=downloader_service.is_local)
+downloader_service.listeners.append(progress_broker.publish)
+
+# Point-in-time gauges, read from the components when /metrics is scraped
+metrics.REGISTRY.register(metrics.Gauge(
+    'downify_queued_jobs', 'Downloads waiting for a worker', ['lane'],
+    callback=lambda: {(lane,): n for lane, n in download_scheduler.stats()['queued'].items()}))
+metrics.REGISTRY.register(metrics.Gauge(
+    'downify_extract_pending', 'Extractions running or queued on the extraction pool', ['state'],
+    callback=lambda: {(k,): v for k, v in extract_executor.stats().items() if k in ('running', 'queued')}))
+metrics.REGISTRY.register(metrics.Gauge(
+    'downify_fragment_concurrency', 'Parallel fragment downloads the next job for a profile and host gets', ['profile', 'host'],
+    callback=downloader_service.accelerator.levels))
+metrics.REGISTRY.register(metrics.Gauge(
+    'downify_metadata_cache_entries', 'Info dicts held by the metadata cache',
+    callback=lambda: {(): downloader_service.metadata_cache.stats()['size']}))
+
+def thumb_base_url(http_request):
+    # Origin the client reached us on, so proxied thumbnail links work from any frontend
+    return str(http_request.base_url).rstrip('/')
+
+
+async def run_extraction(fn, *args):
+    # Runs blocking yt-dlp work on the extraction pool, translating saturation
+    # and deadline failures into fast HTTP errors.
+    try:
+        future = extract_executor.submit(fn, *args, timeout=config.EXTRACT_TIMEOUT)
+    except ExecutorSaturated:
+        raise HTTPException(status_code=503, detail="Extraction is busy, try again shortly", headers={"Retry-After": "2"})
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout=config.EXTRACT_TIMEOUT)
+    except (asyncio.TimeoutError, DeadlineExceeded):
+        raise HTTPException(status_code=504, detail="Extraction timed out")
 
 class DownloadRequest(BaseModel):
     url: str
@@ -30,43 +97,342 @@ class DownloadRequest(BaseModel):
     playlist_start: Optional[int] = None
     playlist_end: Optional[int] = None
     title: Optional[str] = "Download" # Added for folder naming
+    priority: int = 0 # Higher runs first within its lane
+
+class BatchRequest(BaseModel):
+    items: List[DownloadRequest]
 
 # @app.get("/")
 # def read_root():
 #     return {"message": "Downify API is running"}
 
+@app.on_event("startup")
+async def start_progress_broker():
+    progress_broker.start()
+
+@app.on_event("startup")
+async def warm_ydl_pool():
+    # Builds the first YoutubeDL per profile in the background; requests are
+    # served meanwhile (an early one builds its own instance)
+    downloader_service.ydl_pool.start_warmup(config.YDL_POOL_WARM)
+
+def recover_tasks():
+    # Re-enqueue tasks that stopped workers (or our previous run) left unfinished;
+    # they resume from the partial data kept in their task dirs.
+    downloader_service.store.mark_interrupted()
+    for task_id, request in downloader_service.recover(config.RECOVERY_MAX_AGE):
+        try:
+            enqueue_download(DownloadRequest(**request), task_id=task_id)
+            print(f"Recovery: resumed task {task_id}")
+        except Exception as e:
+            print(f"Recovery: could not resume task {task_id}: {e}")
+
+@app.on_event("startup")
+async def start_recovery():
+    if not config.RECOVER_ON_STARTUP:
+        return
+    loop = asyncio.get_running_loop()
+    loop.run_in_executor(None, recover_tasks)
+    # A worker that crashed moments ago still looks alive until its heartbeat ages out.
+    # A memory store has no other workers (and cannot tell which tasks are running).
+    if config.TASK_STORE != 'memory':
+        loop.call_later(config.TASK_OWNER_TIMEOUT + 1, lambda: loop.run_in_executor(None, recover_tasks))
+
+@app.on_event("shutdown")
+async def shutdown_executors():
+    downloader_service.suspend()
+    await progress_broker.stop()
+    extract_executor.shutdown()
+    download_scheduler.shutdown()
+    downloader_service.transcoder.shutdown()
+    downloader_service.ydl_pool.close()
+    downloader_service.store.close()
+
 @app.get("/healthz")
 def health_check():
     return {"status": "ok"}
 
 @app.post("/api/extract")
-async def extract_info(request: DownloadRequest):
+async def extract_info(request: DownloadRequest, http_request: Request):
     try:
-        info = downloader_service.extract_info(request.url)
+        info = await run_extraction(downloader_service.extract_info, request.url, thumb_base_url(http_request))
         return info
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+def stream_extraction(gen_fn, *args):
+    # Runs a blocking generator on the extraction pool and relays its items
+    # as NDJSON. At most 64 items wait for the client (backpressure on the
+    # producer); a client disconnect stops it at the next item, and one that
+    # stops reading for EXTRACT_STREAM_STALL_TIMEOUT gets its worker taken back.
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    room = threading.Semaphore(64)
+    stop = threading.Event()
+    done = object()
+
+    def send(item):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            pass  # event loop already closed
+
+    def put(item):
+        deadline = time.monotonic() + config.EXTRACT_STREAM_STALL_TIMEOUT
+        while not stop.is_set():
+            if room.acquire(timeout=1):
+                send(item)
+                return True
+            if time.monotonic() > deadline:
+                send({"type": "error", "detail": "Stream aborted: client stopped reading"})
+                return False
+        return False
+
+    def produce():
+        try:
+            for item in gen_fn(*args):
+                if not put(item):
+                    return
+        except Exception as e:
+            send({"type": "error", "detail": str(e)})
+        finally:
+            send(done)
+
+    def never_ran(future):
+        # Dropped past its deadline (or by shutdown) before produce() started
+        if future.cancelled():
+            send({"type": "error", "detail": "Extraction cancelled"})
+            send(done)
+        elif isinstance(future.exception(), DeadlineExceeded):
+            send({"type": "error", "detail": "Extraction timed out while queued"})
+            send(done)
+
+    try:
+        future = extract_executor.submit(produce, timeout=config.EXTRACT_TIMEOUT)
+    except ExecutorSaturated:
+        raise HTTPException(status_code=503, detail="Extraction is busy, try again shortly", headers={"Retry-After": "2"})
+    future.add_done_callback(never_ran)
+
+    async def body():
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                room.release()
+                yield json.dumps(item) + "\n"
+        finally:
+            stop.set()
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+@app.post("/api/extract/stream")
+async def extract_info_stream(request: DownloadRequest, http_request: Request, offset: int = 0, limit: Optional[int] = None):
+    if offset < 0 or (limit is not None and limit <= 0):
+        raise HTTPException(status_code=400, detail="Invalid offset/limit")
+    return stream_extraction(downloader_service.iter_extract, request.url, offset, limit, thumb_base_url(http_request))
+
+@app.get("/api/cache/stats")
+def cache_stats():
+    stats = downloader_service.metadata_cache.stats()
+    stats["extract_executor"] = extract_executor.stats()
+    stats["download_scheduler"] = download_scheduler.stats()
+    stats["progress_broker"] = progress_broker.stats()
+    stats["tasks"] = downloader_service.tasks.stats()
+    stats["task_store"] = downloader_service.store.stats()
+    stats["result_cache"] = downloader_service.results.stats()
+    stats["transcoder"] = downloader_service.transcoder.stats()
+    stats["ydl_pool"] = downloader_service.ydl_pool.stats()
+    stats["acceleration"] = downloader_service.accelerator.stats()
+    stats["staging"] = downloader_service.staging.stats()
+    if downloader_service.thumbnails is not None:
+        stats["thumbnails"] = downloader_service.thumbnails.stats()
+    stats["batches"] = {**batch_registry.stats(), "prefetch": batch_prefetcher.stats()}
+    return stats
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+def schedule_download(task_id, request):
+    lane = downloader_service.classify_lane(request)
+    job = download_scheduler.submit(
+        task_id, downloader_service.process_download, (task_id, request),
+        lane=lane, host=host_of(request.url), priority=request.priority,
+    )
+    return {"task_id": task_id, "status": "queued", "lane": lane, **(download_scheduler.describe(job.task_id) or {})}
+
+def enqueue_download(request, task_id=None):
+    task_id = task_id or str(uuid.uuid4())
+    downloader_service.mark_queued(task_id, request)
+    return schedule_download(task_id, request)
+
 @app.post("/api/queue-download")
-async def queue_download(request: DownloadRequest, background_tasks: BackgroundTasks):
-    task_id = str(uuid.uuid4())
-    background_tasks.add_task(downloader_service.process_download, task_id, request)
-    return {"task_id": task_id, "status": "queued"}
+async def queue_download(request: DownloadRequest):
+    return enqueue_download(request)
+
+def schedule_batch_items(jobs):
+    # Prefetch finished for one URL: its tasks go to the scheduler, classified
+    # with the now cached metadata. Tasks cancelled meanwhile stay out.
+    for task_id, request in jobs:
+        status = downloader_service.get_status(task_id)
+        if not status or status.get('status') != 'queued':
+            downloader_service.cancelled.discard(task_id)
+            continue
+        schedule_download(task_id, request)
+
+@app.post("/api/batch")
+async def queue_batch(batch_request: BatchRequest):
+    # One call for many downloads. Identical requests share one task, every
+    # distinct URL is extracted once, and each download is scheduled as soon
+    # as its own metadata is in, while the rest of the batch is still extracting.
+    requests = batch_request.items
+    if not requests:
+        raise HTTPException(status_code=400, detail="Batch is empty")
+    if len(requests) > config.BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch is limited to {config.BATCH_MAX_ITEMS} items")
+
+    batch, unique = plan_batch(requests)
+    groups = {}  # normalized url -> (url, [(task_id, request)])
+    for task_id, request in unique:
+        downloader_service.mark_queued(task_id, request)
+        key = normalize_url(request.url)
+        groups.setdefault(key, (request.url, []))[1].append((task_id, request))
+    batch_registry.add(batch)
+    batch_prefetcher.run(list(groups.values()), schedule_batch_items)
+    return summarize(batch, task_snapshot)
+
+@app.get("/api/batch/{batch_id}")
+async def get_batch(batch_id: str):
+    batch = batch_registry.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return summarize(batch, task_snapshot)
+
+@app.get("/api/stream")
+async def stream_download(url: str, type: str = "video", quality: str = "1080", platform: str = "custom"):
+    # Opt-in stream-through: progressive sources are piped straight to the
+    # client with nothing written to disk. Anything needing merge or
+    # post-processing is queued on the normal path instead (202 + task_id).
+    try:
+        plan = await run_extraction(downloader_service.plan_stream, url, type, quality)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if plan is None:
+        request = DownloadRequest(url=url, platform=platform, type=type, quality=quality)
+        return JSONResponse(status_code=202, content={"mode": "disk", **enqueue_download(request)})
+
+    try:
+        source, close = await asyncio.to_thread(downloader_service.open_stream, plan)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Source unavailable: {e}")
+
+    headers = {"Content-Disposition": content_disposition(plan["filename"])}
+    length = source.headers.get("Content-Length") or plan.get("filesize")
+    if length:
+        headers["Content-Length"] = str(length)
+    media_type = source.headers.get("Content-Type") or "application/octet-stream"
+    relay = StreamRelay(source, config.STREAM_CHUNK_SIZE, config.STREAM_BUFFER_CHUNKS, on_close=close)
+    return StreamingResponse(relay, media_type=media_type, headers=headers)
+
+@app.get("/api/thumb")
+async def get_thumbnail(request: Request, u: str, s: str):
+    # Resized playlist thumbnail; URLs come signed from the extract payloads.
+    # The content behind a URL never changes, so browsers may keep it for good.
+    cache = downloader_service.thumbnails
+    if cache is None:
+        raise HTTPException(status_code=404, detail="Thumbnail proxy disabled")
+    src = cache.verify(u, s)
+    if src is None:
+        raise HTTPException(status_code=403, detail="Invalid thumbnail signature")
+    headers = {"Cache-Control": "public, max-age=31536000, immutable"}
+    try:
+        data, media_type, etag = await asyncio.to_thread(cache.load, src)
+    except ThumbnailError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    headers["ETag"] = etag
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=data, media_type=media_type, headers=headers)
 
 @app.get("/api/status/{task_id}")
 async def get_status(task_id: str):
-    status = downloader_service.get_status(task_id)
+    status = task_snapshot(task_id)
     if not status:
         raise HTTPException(status_code=404, detail="Task not found")
     return status
 
-@app.get("/api/file/{file_id}")
-async def get_file(file_id: str):
+@app.websocket("/ws/progress")
+async def progress_socket(websocket: WebSocket):
+    # Clients send {"subscribe": [task_id, ...]} / {"unsubscribe": [...]} and
+    # receive {"task_id": ..., <same fields as /api/status>} pushes.
+    await websocket.accept()
+    sub = Subscription(progress_broker)
+
+    async def sender():
+        while True:
+            message = await sub.queue.get()
+            await websocket.send_json(message)
+
+    send_task = asyncio.create_task(sender())
+    try:
+        while True:
+            msg = await websocket.receive_json()
+            if not isinstance(msg, dict):
+                continue
+            if msg.get("subscribe"):
+                progress_broker.subscribe(sub, [str(t) for t in msg["subscribe"]])
+            if msg.get("unsubscribe"):
+                progress_broker.unsubscribe(sub, [str(t) for t in msg["unsubscribe"]])
+    except (WebSocketDisconnect, ValueError):
+        pass
+    finally:
+        send_task.cancel()
+        progress_broker.unsubscribe(sub)
+
+def cancel_local_task(task_id):
+    where = download_scheduler.cancel(task_id)
+    if where == 'queued':
+        downloader_service.cancel(task_id)
+        downloader_service.cancelled.discard(task_id)
+        return "cancelled"
+    if where is None:
+        # Not owned by the scheduler (or just being picked up): let the task stop itself
+        downloader_service.cancel(task_id)
+    return "cancelling"
+
+# Cancels requested through other workers arrive via the task store
+downloader_service.store.on_cancel = cancel_local_task
+
+@app.post("/api/cancel/{task_id}")
+async def cancel_task(task_id: str):
+    status = downloader_service.get_status(task_id)
+    if not status:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if status.get('status') not in ('queued', 'processing'):
+        raise HTTPException(status_code=409, detail=f"Task is already {status.get('status')}")
+
+    if not downloader_service.is_local(task_id):
+        if not downloader_service.store.request_cancel(task_id):
+            raise HTTPException(status_code=409, detail="Task can no longer be cancelled")
+        return {"task_id": task_id, "status": "cancelling"}
+    return {"task_id": task_id, "status": cancel_local_task(task_id)}
+
+@app.get("/api/file/{file_id:path}")
+async def get_file(file_id: str, request: Request):
+    # Files support Range/If-None-Match; a playlist folder streams as one ZIP
     file_path = downloader_service.get_file_path(file_id)
-    if not os.path.exists(file_path):
+    if not file_path or not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="File not found")
-    
-    return FileResponse(file_path, filename=os.path.basename(file_path))
+
+    if os.path.isdir(file_path):
+        return zip_response(request, file_path, os.path.basename(file_path))
+    return file_response(request, file_path)
 
 # Serve Frontend (Single-Service Mode)
 # Check multiple locations for the frontend build
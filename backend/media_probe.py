@@ -0,0 +1,81 @@
+import json
+import shutil
+import subprocess
+
+FFPROBE = shutil.which('ffprobe')
+
+
+def probe(path):
+    # ffprobe's view of a media file: {'format': {...}, 'streams': [...]}, or None
+    if not FFPROBE:
+        return None
+    cmd = [
+        FFPROBE, '-v', 'error',
+        '-show_format', '-show_streams',
+        '-of', 'json', path,
+    ]
+    try:
+        out = subprocess.run(cmd, check=True, capture_output=True, timeout=60).stdout
+        return json.loads(out)
+    except (subprocess.SubprocessError, ValueError) as e:
+        print(f"ffprobe failed for {path}: {e}")
+        return None
+
+
+def duration(info):
+    # Seconds, from the container or else the longest stream
+    if not info:
+        return None
+    candidates = [info.get('format', {}).get('duration')]
+    candidates += [s.get('duration') for s in info.get('streams', [])]
+    values = []
+    for value in candidates:
+        try:
+            values.append(float(value))
+        except (TypeError, ValueError):
+            continue
+    return max(values) if values else None
+
+
+def streams(info, codec_type):
+    return [s for s in (info or {}).get('streams', []) if s.get('codec_type') == codec_type]
+
+
+# Codecs each output container can carry as-is (stream copy). Anything else
+# has to be re-encoded; mkv accepts everything we download.
+CONTAINER_CODECS = {
+    'mp4': {
+        'video': {'h264', 'hevc', 'av1', 'vp9', 'mpeg4'},
+        'audio': {'aac', 'mp3', 'opus', 'alac', 'flac', 'ac3', 'eac3'},
+    },
+    'webm': {
+        'video': {'vp8', 'vp9', 'av1'},
+        'audio': {'opus', 'vorbis'},
+    },
+    'mp3': {'video': set(), 'audio': {'mp3'}},
+    'm4a': {'video': set(), 'audio': {'aac', 'alac'}},
+}
+
+
+def codec(info, codec_type):
+    # codec_name of the first stream of that type, or None
+    found = streams(info, codec_type)
+    return found[0].get('codec_name') if found else None
+
+
+def bitrate(info, codec_type):
+    # bits/s of the first stream of that type, falling back to the container's
+    found = streams(info, codec_type)
+    for value in ([found[0].get('bit_rate')] if found else []) + [(info or {}).get('format', {}).get('bit_rate')]:
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def can_copy(container, codec_type, codec_name):
+    if container == 'mkv':
+        return True
+    allowed = CONTAINER_CODECS.get(container, {}).get(codec_type, set())
+    return codec_name in allowed
@@ -0,0 +1,151 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+# Query parameters that never change what yt-dlp extracts
+_TRACKING_PARAMS = {'si', 'feature', 'pp', 'fbclid', 'gclid', 'igshid', 'igsh', 'ref', 'ref_src'}
+
+# Sites whose extractors treat http/https and the www./m. hosts as the same
+# page. Anywhere else those can serve different media, so they stay part of the key.
+_ALIASED_HOSTS = {
+    'youtube.com', 'facebook.com', 'instagram.com', 'twitter.com', 'x.com',
+    'tiktok.com', 'reddit.com', 'vimeo.com', 'dailymotion.com',
+}
+
+
+def normalize_url(url):
+    url = (url or '').strip()
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return url
+    if not parts.scheme or not parts.netloc:
+        return url
+
+    scheme = parts.scheme.lower()
+    host = parts.netloc.lower()
+    bare = host.split(':')[0]
+    for prefix in ('www.', 'm.'):
+        if bare.startswith(prefix) and bare[len(prefix):] in _ALIASED_HOSTS:
+            bare, host = bare[len(prefix):], host[len(prefix):]
+    if bare in _ALIASED_HOSTS and scheme == 'http':
+        scheme = 'https'
+
+    query = [
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k not in _TRACKING_PARAMS and not k.startswith('utm_')
+    ]
+    query.sort()
+    path = parts.path.rstrip('/') or '/'
+    # Drop the fragment, it is never sent to the server
+    return urlunsplit((scheme, host, path, urlencode(query), ''))
+
+
+class MetadataCache:
+    # TTL + LRU cache of yt-dlp info dicts. Concurrent lookups for the same
+    # key share a single in-flight extraction instead of each running one.
+
+    def __init__(self, max_entries=256, ttl=600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._inflight = {}  # key -> Future
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def get_or_load(self, url, loader):
+        key = normalize_url(url)
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                self.hits += 1
+                return value
+
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                owner = False
+            else:
+                self.misses += 1
+                future = Future()
+                self._inflight[key] = future
+                owner = True
+
+        if not owner:
+            return future.result()
+
+        try:
+            value = loader(url)
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._inflight.pop(key, None)
+            # Failed extractions (None) are not cached so the next call retries
+            if value is not None:
+                self._store(key, value)
+        future.set_result(value)
+        return value
+
+    def peek(self, url):
+        # Cached value without loading or touching the counters
+        with self._lock:
+            return self._lookup(normalize_url(url))
+
+    def put(self, url, value):
+        if value is None:
+            return
+        with self._lock:
+            self._store(normalize_url(url), value)
+
+    def invalidate(self, url):
+        with self._lock:
+            self._entries.pop(normalize_url(url), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "inflight": len(self._inflight),
+                "hit_ratio": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+            }
+
+    # Callers must hold self._lock
+
+    def _lookup(self, key):
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.evictions += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _store(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
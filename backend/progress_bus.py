@@ -0,0 +1,124 @@
+import asyncio
+import threading
+
+TERMINAL_STATES = ('completed', 'error', 'cancelled')
+
+
+class Subscription:
+    def __init__(self, broker):
+        self.broker = broker
+        self.task_ids = set()
+        self.queue = asyncio.Queue(maxsize=256)
+
+    def offer(self, message):
+        # Slow consumers lose intermediate updates, never the latest one
+        if self.queue.full():
+            try:
+                self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+        self.queue.put_nowait(message)
+
+
+class ProgressBroker:
+    # Download threads only mark a task dirty; the event loop flushes dirty
+    # tasks every `interval` seconds, reading the current snapshot once per
+    # task no matter how many progress ticks happened in between. Tasks that
+    # `is_local` says run on another worker never publish here and are
+    # re-read (from the shared task store) every interval until they finish.
+
+    def __init__(self, snapshot_fn, interval=0.25, is_local=None):
+        self.snapshot_fn = snapshot_fn
+        self.interval = interval
+        self.is_local = is_local
+        self._loop = None
+        self._flusher = None
+        self._lock = threading.Lock()
+        self._dirty = set()
+        self._subs = {}  # task_id -> set(Subscription)
+        self._last_sent = {}  # task_id -> last snapshot pushed
+        self.published = 0
+        self.sent = 0
+
+    def start(self, loop=None):
+        self._loop = loop or asyncio.get_running_loop()
+        self._flusher = self._loop.create_task(self._run())
+
+    async def stop(self):
+        if self._flusher:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+
+    def publish(self, task_id, status=None):
+        # Safe to call from any thread
+        with self._lock:
+            self.published += 1
+            if task_id not in self._subs:
+                return
+            self._dirty.add(task_id)
+        if status in TERMINAL_STATES and self._loop is not None:
+            # Final states skip the throttle
+            self._loop.call_soon_threadsafe(self._flush)
+
+    def subscribe(self, sub, task_ids):
+        with self._lock:
+            for task_id in task_ids:
+                sub.task_ids.add(task_id)
+                self._subs.setdefault(task_id, set()).add(sub)
+        for task_id in task_ids:
+            snapshot = self.snapshot_fn(task_id)
+            if snapshot is not None:
+                self._last_sent[task_id] = snapshot
+            sub.offer({"task_id": task_id, **(snapshot or {"status": "unknown"})})
+
+    def unsubscribe(self, sub, task_ids=None):
+        with self._lock:
+            for task_id in list(task_ids if task_ids is not None else sub.task_ids):
+                sub.task_ids.discard(task_id)
+                subs = self._subs.get(task_id)
+                if subs is not None:
+                    subs.discard(sub)
+                    if not subs:
+                        del self._subs[task_id]
+                        self._last_sent.pop(task_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "subscribed_tasks": len(self._subs),
+                "published": self.published,
+                "sent": self.sent,
+            }
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self._flush()
+
+    def _flush(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            for task_id in self._subs:
+                snap = self._last_sent.get(task_id)
+                status = snap.get('status') if snap else None
+                # Queued tasks move up without any event of their own
+                if status == 'queued' or (
+                        status not in TERMINAL_STATES and self.is_local is not None and not self.is_local(task_id)):
+                    dirty.add(task_id)
+            targets = {t: list(self._subs.get(t, ())) for t in dirty}
+
+        for task_id, subs in targets.items():
+            if not subs:
+                continue
+            snapshot = self.snapshot_fn(task_id)
+            if snapshot is None or snapshot == self._last_sent.get(task_id):
+                continue
+            self._last_sent[task_id] = snapshot
+            message = {"task_id": task_id, **snapshot}
+            for sub in subs:
+                sub.offer(message)
+                self.sent += 1
@@ -0,0 +1,186 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+
+def result_key(extractor, media_id, *options):
+    # Stable key for a download result; media without an identity is not cacheable
+    if not extractor or not media_id:
+        return None
+    parts = [extractor, media_id, *options]
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ResultCache:
+    # Index of finished outputs in downloads_dir, keyed on what was asked for
+    # (media id, extractor, type, quality, upscale decision, ...). Identical
+    # requests reuse the existing output, identical requests running at the
+    # same time share one download, and the directory is kept under `quota`
+    # bytes by deleting least recently used outputs.
+
+    def __init__(self, downloads_dir, db_path, quota=0):
+        self.downloads_dir = downloads_dir
+        self.db_path = db_path
+        self.quota = quota
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._inflight = {}  # key -> Future resolving to the result dict
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                task_id TEXT,
+                output_type TEXT,
+                file_id TEXT,
+                files TEXT,
+                size INTEGER,
+                created_at REAL,
+                last_access REAL,
+                hits INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS results_lru ON results(last_access);
+        """)
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    def _paths(self, output_type, file_id, files):
+        if output_type == 'folder':
+            return [os.path.join(self.downloads_dir, file_id, f) for f in files]
+        folder = os.path.dirname(file_id)
+        if folder:
+            # Published task dir (see staging.py): every file of the result lives there
+            return [os.path.join(self.downloads_dir, folder, f) for f in files]
+        return [os.path.join(self.downloads_dir, file_id)]
+
+    def lookup(self, key):
+        if key is None:
+            return None
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT output_type, file_id, files FROM results WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        output_type, file_id, files = row[0], row[1], json.loads(row[2])
+        if not all(os.path.exists(p) for p in self._paths(output_type, file_id, files)):
+            # Output was removed behind our back
+            with conn:
+                conn.execute("DELETE FROM results WHERE key = ?", (key,))
+            return None
+        with conn:
+            conn.execute("UPDATE results SET last_access = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+        with self._lock:
+            self.hits += 1
+        return {"output_type": output_type, "file_id": file_id, "files": files}
+
+    def claim(self, key):
+        # Returns (is_leader, future). The leader downloads and must call
+        # release(); followers wait on the future for the leader's result.
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return False, future
+            self.misses += 1
+            future = Future()
+            self._inflight[key] = future
+            return True, future
+
+    def release(self, key, result):
+        with self._lock:
+            future = self._inflight.pop(key, None)
+        if future is not None:
+            future.set_result(result)
+
+    def store(self, key, task_id, output_type, file_id, files):
+        # Every finished output is indexed so the quota covers it; results
+        # without a shareable key are stored under a per-task key.
+        key = key or f"task:{task_id}"
+        size = 0
+        for path in self._paths(output_type, file_id, files):
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO results (key, task_id, output_type, file_id, files, size, created_at, last_access)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (key, task_id, output_type, file_id, json.dumps(files), size, now, now))
+        self.enforce_quota(protect={key})
+
+    def usage(self):
+        row = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        return row[0], row[1]
+
+    def enforce_quota(self, protect=()):
+        if not self.quota:
+            return
+        conn = self._conn()
+        _, used = self.usage()
+        if used <= self.quota:
+            return
+        rows = conn.execute(
+            "SELECT key, output_type, file_id, files, size FROM results ORDER BY last_access"
+        ).fetchall()
+        with self._lock:
+            busy = set(self._inflight)
+        for key, output_type, file_id, files, size in rows:
+            if used <= self.quota:
+                break
+            if key in protect or key in busy:
+                continue
+            self._delete_output(output_type, file_id, json.loads(files))
+            with conn:
+                conn.execute("DELETE FROM results WHERE key = ?", (key,))
+            used -= size or 0
+            with self._lock:
+                self.evictions += 1
+            print(f"Result cache: evicted {file_id} ({size} bytes)")
+
+    def _delete_output(self, output_type, file_id, files):
+        for path in self._paths(output_type, file_id, files):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        folder = file_id if output_type == 'folder' else os.path.dirname(file_id)
+        if folder:
+            folder = os.path.join(self.downloads_dir, folder)
+            try:
+                os.rmdir(folder)  # only if nothing else lives there
+            except OSError:
+                pass
+
+    def stats(self):
+        entries, used = self.usage()
+        with self._lock:
+            return {
+                "entries": entries,
+                "bytes": used,
+                "quota": self.quota,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "inflight": len(self._inflight),
+            }
@@ -0,0 +1,160 @@
+import bisect
+import itertools
+import threading
+import time
+from urllib.parse import urlsplit
+import metrics
+
+LIGHT = 'light'
+HEAVY = 'heavy'
+
+
+def host_of(url):
+    try:
+        host = (urlsplit(url).hostname or '').lower()
+    except ValueError:
+        return ''
+    return host[4:] if host.startswith('www.') else host
+
+
+class Job:
+    __slots__ = ('task_id', 'fn', 'args', 'lane', 'host', 'priority', 'seq', 'submitted_at', 'started_at')
+
+    def __init__(self, task_id, fn, args, lane, host, priority, seq):
+        self.task_id = task_id
+        self.fn = fn
+        self.args = args
+        self.lane = lane
+        self.host = host
+        self.priority = priority
+        self.seq = seq
+        self.submitted_at = time.time()
+        self.started_at = None
+
+    def sort_key(self):
+        # Higher priority first, then FIFO
+        return (-self.priority, self.seq)
+
+
+class DownloadScheduler:
+    # Fixed worker pools per lane pulling from priority queues. A job is only
+    # started when its host is below the per-host concurrency limit, so one
+    # site cannot occupy every worker.
+
+    def __init__(self, lanes, per_host_limit=3, on_cancel=None):
+        self.per_host_limit = per_host_limit
+        self.on_cancel = on_cancel  # called with task_id to stop a running job
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._queues = {lane: [] for lane in lanes}  # lane -> [Job] kept sorted by Job.sort_key
+        self._queued = {}  # task_id -> Job
+        self._running = {}  # task_id -> Job
+        self._host_active = {}
+        self._stopping = False
+        self._workers = []
+        self.completed = 0
+        self.cancelled = 0
+
+        for lane, count in lanes.items():
+            for i in range(count):
+                t = threading.Thread(target=self._worker, args=(lane,), name=f"download-{lane}-{i}", daemon=True)
+                t.start()
+                self._workers.append(t)
+
+    def submit(self, task_id, fn, args=(), lane=LIGHT, host='', priority=0):
+        if lane not in self._queues:
+            lane = LIGHT
+        with self._cond:
+            job = Job(task_id, fn, args, lane, host, priority or 0, next(self._seq))
+            bisect.insort(self._queues[lane], job, key=Job.sort_key)
+            self._queued[task_id] = job
+            self._cond.notify_all()
+        return job
+
+    def cancel(self, task_id):
+        with self._cond:
+            job = self._queued.pop(task_id, None)
+            if job is not None:
+                queue = self._queues[job.lane]
+                queue.pop(self._position(job) - 1)
+                self.cancelled += 1
+                return 'queued'
+            running = task_id in self._running
+        if running and self.on_cancel:
+            self.on_cancel(task_id)
+            return 'running'
+        return None
+
+    def describe(self, task_id):
+        with self._cond:
+            job = self._queued.get(task_id)
+            if job is not None:
+                return {
+                    "lane": job.lane,
+                    "queue_position": self._position(job),
+                    "queue_length": len(self._queues[job.lane]),
+                    "wait_time": round(time.time() - job.submitted_at, 2),
+                }
+            job = self._running.get(task_id)
+            if job is not None:
+                return {
+                    "lane": job.lane,
+                    "queue_position": 0,
+                    "wait_time": round(job.started_at - job.submitted_at, 2),
+                    "run_time": round(time.time() - job.started_at, 2),
+                }
+        return None
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queued": {lane: len(q) for lane, q in self._queues.items()},
+                "running": len(self._running),
+                "hosts": {h: n for h, n in self._host_active.items() if n},
+                "completed": self.completed,
+                "cancelled": self.cancelled,
+            }
+
+    def shutdown(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+
+    # Callers must hold self._cond
+
+    def _position(self, job):
+        return bisect.bisect_left(self._queues[job.lane], job.sort_key(), key=Job.sort_key) + 1
+
+    def _take_next(self, lane):
+        queue = self._queues[lane]
+        for i, job in enumerate(queue):
+            if self._host_active.get(job.host, 0) < self.per_host_limit:
+                del queue[i]
+                del self._queued[job.task_id]
+                return job
+        return None
+
+    def _worker(self, lane):
+        while True:
+            with self._cond:
+                job = self._take_next(lane)
+                while job is None:
+                    if self._stopping:
+                        return
+                    self._cond.wait()
+                    job = self._take_next(lane)
+                job.started_at = time.time()
+                metrics.QUEUE_WAIT.observe(job.started_at - job.submitted_at, lane=lane)
+                self._running[job.task_id] = job
+                self._host_active[job.host] = self._host_active.get(job.host, 0) + 1
+
+            try:
+                job.fn(*job.args)
+            except Exception as e:
+                print(f"Scheduler: task {job.task_id} raised {e}")
+            finally:
+                with self._cond:
+                    self._running.pop(job.task_id, None)
+                    self._host_active[job.host] -= 1
+                    self.completed += 1
+                    self._cond.notify_all()
@@ -0,0 +1,146 @@
+import errno
+import os
+import shutil
+import threading
+
+
+class StagedTask:
+    # A running task's working directory and the files yt-dlp reported
+    # producing in it. Its hooks record finished downloads (progress hook)
+    # and the final file of every video after post-processing (post hook,
+    # e.g. the merged .mp4 in place of its .fNNN parts), so the output list
+    # never comes from listing the directory.
+
+    def __init__(self, task_id, path):
+        self.task_id = task_id
+        self.path = path
+        self._files = {}  # name -> None, in the order they were produced
+        self._lock = threading.Lock()  # playlist entries report from several threads
+
+    def progress_hook(self, d):
+        if d['status'] == 'finished':
+            self.record(d.get('filename'))
+
+    def post_hook(self, filepath):
+        self.record(filepath)
+
+    def record(self, path):
+        if not path or os.path.dirname(os.path.abspath(path)) != self.path:
+            return
+        with self._lock:
+            self._files.setdefault(os.path.basename(path))
+
+    def files(self):
+        # Produced files still present: merged-away parts and converted sources drop out
+        with self._lock:
+            names = list(self._files)
+        return [name for name in names if os.path.isfile(os.path.join(self.path, name))]
+
+
+class Staging:
+    # Where tasks work until they finish. Task dirs live under `root`, which
+    # should be on the output filesystem: publishing a finished task is then
+    # one rename of its directory to a name reserved in the output dir, no
+    # matter how many files or bytes it holds. Jobs expected to need at most
+    # `small_limit` bytes may stage under `small_root` instead (e.g. a tmpfs);
+    # those are copied across once when published.
+
+    def __init__(self, output_dir, root, small_root=None, small_limit=0):
+        self.output_dir = os.path.realpath(output_dir)
+        self.root = os.path.realpath(root)
+        self.small_root = os.path.realpath(small_root) if small_root else None
+        self.small_limit = small_limit
+        os.makedirs(self.root, exist_ok=True)
+        if self.small_root:
+            os.makedirs(self.small_root, exist_ok=True)
+        if os.stat(self.root).st_dev != os.stat(self.output_dir).st_dev:
+            print(f"WARNING: staging dir {self.root} is not on the filesystem of {self.output_dir}; outputs will be copied")
+        self._lock = threading.Lock()
+        self.published = 0
+        self.copied = 0
+        self.small = 0
+
+    def roots(self):
+        return [root for root in (self.root, self.small_root) if root]
+
+    def contains(self, path):
+        return any(path == root or path.startswith(root + os.sep) for root in self.roots())
+
+    def find(self, task_id):
+        # Existing task dir of a resumed task, wherever it was staged
+        for root in self.roots():
+            path = os.path.join(root, task_id)
+            if os.path.isdir(path):
+                return path
+        return None
+
+    def open(self, task_id, expected_size=0):
+        # expected_size: peak bytes the job should need, 0 when unknown
+        path = self.find(task_id)
+        if path is None:
+            small = self.small_root and 0 < expected_size <= self.small_limit
+            path = os.path.join(self.small_root if small else self.root, task_id)
+            if small:
+                with self._lock:
+                    self.small += 1
+        os.makedirs(path, exist_ok=True)
+        return StagedTask(task_id, path)
+
+    def discard(self, staged):
+        shutil.rmtree(staged.path, ignore_errors=True)
+
+    def publish(self, staged, name):
+        # Moves the task dir into the output dir as `name`, or `name_2`, `name_3`...
+        # when taken; returns the name used. Names are reserved with mkdir, so
+        # concurrent tasks never share (or merge into) a directory.
+        target_name = self._reserve(name)
+        target = os.path.join(self.output_dir, target_name)
+        try:
+            # Replaces the empty reservation in one step
+            os.rename(staged.path, target)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                os.rmdir(target)
+                raise
+            self._copy(staged, target)
+        with self._lock:
+            self.published += 1
+        return target_name
+
+    def _reserve(self, name):
+        n = 1
+        while True:
+            candidate = name if n == 1 else f"{name}_{n}"
+            try:
+                os.mkdir(os.path.join(self.output_dir, candidate))
+                return candidate
+            except FileExistsError:
+                n += 1
+
+    def _copy(self, staged, target):
+        # Staged on another filesystem: copy next to the target, then rename into place
+        tmp = os.path.join(self.output_dir, f".{staged.task_id}.incoming")
+        try:
+            shutil.copytree(staged.path, tmp)
+            os.rename(tmp, target)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            try:
+                os.rmdir(target)
+            except OSError:
+                pass
+            raise
+        shutil.rmtree(staged.path, ignore_errors=True)
+        with self._lock:
+            self.copied += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "root": self.root,
+                "small_root": self.small_root,
+                "small_limit": self.small_limit,
+                "published": self.published,
+                "copied": self.copied,
+                "small": self.small,
+            }
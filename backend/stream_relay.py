@@ -0,0 +1,65 @@
+import queue
+import threading
+
+_DONE = object()
+
+
+class StreamRelay:
+    # Copies a source response to the client through a bounded queue. A
+    # reader thread fetches up to `max_chunks` ahead; when the client is
+    # slower the queue fills and the reader blocks, so the source is read no
+    # faster than the client consumes it.
+
+    def __init__(self, source, chunk_size=256 * 1024, max_chunks=16, on_close=None):
+        self.source = source
+        self.on_close = on_close
+        self.chunk_size = chunk_size
+        self._queue = queue.Queue(maxsize=max_chunks)
+        self._stop = threading.Event()
+        self.bytes_sent = 0
+        self._reader = threading.Thread(target=self._read, name="stream-relay", daemon=True)
+        self._reader.start()
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _read(self):
+        try:
+            while not self._stop.is_set():
+                chunk = self.source.read(self.chunk_size)
+                if not chunk:
+                    break
+                if not self._put(chunk):
+                    return
+        except Exception as e:
+            self._put(e)
+        finally:
+            try:
+                self.source.close()
+                if self.on_close:
+                    self.on_close()
+            except Exception:
+                pass
+            self._put(_DONE)
+
+    def __iter__(self):
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    # Headers are already sent; cutting the body short is all we can do
+                    print(f"Stream relay aborted: {item}")
+                    return
+                self.bytes_sent += len(item)
+                yield item
+        finally:
+            # Client went away (or we finished): let the reader exit
+            self._stop.set()
@@ -0,0 +1,145 @@
+import threading
+import time
+from collections import OrderedDict
+
+FINISHED_STATES = ('completed', 'error', 'cancelled')
+
+
+class EntryState:
+    # Progress of one playlist entry
+    __slots__ = ('state', 'title', 'progress', 'downloaded_bytes', 'total_bytes', 'speed', 'file', 'error', 'last_hook')
+    # Bookkeeping fields not exposed through get_status
+    _internal = ('last_hook',)
+
+    def __init__(self, title=None):
+        self.state = 'queued'
+        self.title = title
+        self.progress = 0.0
+        self.downloaded_bytes = 0
+        self.total_bytes = 0
+        self.speed = 0
+        self.file = None
+        self.error = None
+        self.last_hook = 0.0  # monotonic time of the last progress update applied
+
+    def to_dict(self):
+        return {
+            k: getattr(self, k) for k in self.__slots__
+            if k not in self._internal and getattr(self, k) is not None
+        }
+
+
+class TaskState:
+    __slots__ = (
+        'task_id', 'status', 'progress', 'speed', 'eta', 'downloaded_bytes', 'total_bytes',
+        'current_file', 'playlist_index', 'playlist_total', 'entries',
+        'output_type', 'file_id', 'files', 'error', 'cache_hit', 'stages',
+        'created_at', 'updated_at', 'finished_at', 'last_hook', 'fetched_bytes', 'request',
+    )
+    # Bookkeeping fields not exposed through get_status
+    _internal = ('task_id', 'created_at', 'updated_at', 'finished_at', 'last_hook', 'fetched_bytes', 'request')
+
+    def __init__(self, task_id, status='queued'):
+        now = time.time()
+        self.task_id = task_id
+        self.status = status
+        self.progress = 0.0
+        self.speed = None
+        self.eta = None
+        self.downloaded_bytes = None
+        self.total_bytes = None
+        self.current_file = None
+        self.playlist_index = None
+        self.playlist_total = None
+        self.entries = None  # str(playlist_index) -> EntryState
+        self.output_type = None
+        self.file_id = None
+        self.files = None
+        self.error = None
+        self.cache_hit = None
+        self.stages = None  # stage name -> seconds spent, see metrics.span
+        self.created_at = now
+        self.updated_at = now
+        self.finished_at = None
+        self.last_hook = 0.0
+        self.fetched_bytes = 0  # sizes of all files downloaded this run (every stream, every entry)
+        self.request = None  # DownloadRequest as a plain dict, journaled for other workers
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    def to_dict(self):
+        out = {}
+        for k in self.__slots__:
+            if k in self._internal:
+                continue
+            v = getattr(self, k)
+            if v is None:
+                continue
+            if k == 'entries':
+                v = {key: e.to_dict() for key, e in v.items()}
+            out[k] = v
+        return out
+
+
+class TaskRegistry:
+    # task_id -> TaskState. Active tasks are kept indefinitely; finished ones
+    # are dropped after `ttl` seconds or once more than `max_finished` exist.
+
+    def __init__(self, ttl=6 * 3600, max_finished=2000):
+        self.ttl = ttl
+        self.max_finished = max_finished
+        self._tasks = {}
+        self._finished = OrderedDict()  # task_id -> finished_at, oldest first
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def create(self, task_id, status='queued'):
+        task = TaskState(task_id, status)
+        with self._lock:
+            self._tasks[task_id] = task
+            self._finished.pop(task_id, None)
+            self._evict()
+        return task
+
+    def get(self, task_id):
+        return self._tasks.get(task_id)
+
+    def __contains__(self, task_id):
+        return task_id in self._tasks
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def finish(self, task, status, error=None):
+        task.status = status
+        task.error = error
+        task.finished_at = task.updated_at = time.time()
+        with self._lock:
+            if task.task_id in self._tasks:
+                self._finished[task.task_id] = task.finished_at
+                self._finished.move_to_end(task.task_id)
+            self._evict()
+
+    def active(self):
+        return [t for t in list(self._tasks.values()) if not t.finished]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "tasks": len(self._tasks),
+                "finished": len(self._finished),
+                "evicted": self.evicted,
+            }
+
+    def _evict(self):
+        # Callers must hold self._lock
+        cutoff = time.time() - self.ttl
+        while self._finished:
+            task_id, finished_at = next(iter(self._finished.items()))
+            if finished_at >= cutoff and len(self._finished) <= self.max_finished:
+                break
+            self._finished.popitem(last=False)
+            self._tasks.pop(task_id, None)
+            self.evicted += 1
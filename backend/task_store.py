@@ -0,0 +1,332 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from task_state import FINISHED_STATES
+
+# Start time included: a restarted container often gets the same hostname and pid
+OWNER_ID = f"{socket.gethostname()}:{os.getpid()}:{int(time.time())}"
+
+
+class MemoryTaskStore:
+    # Single-process store: the in-memory TaskRegistry is already the source of truth
+
+    def record(self, task):
+        pass
+
+    def load(self, task_id):
+        return None
+
+    def load_request(self, task_id):
+        return None
+
+    def request_cancel(self, task_id):
+        return False
+
+    def mark_interrupted(self):
+        return 0
+
+    def interrupted(self, max_age):
+        return []
+
+    def claim_interrupted(self, task_id):
+        return True
+
+    def adopt(self, task_id, request):
+        return True
+
+    def unfinished(self):
+        return []
+
+    def save_batch(self, batch_id, items, created_at):
+        pass
+
+    def load_batch(self, batch_id):
+        return None
+
+    def stats(self):
+        return {"backend": "memory"}
+
+    def close(self):
+        pass
+
+
+class SQLiteTaskStore:
+    # Journal of task state in an SQLite file (WAL mode) shared by every
+    # worker process on the host. record() only remembers the task object;
+    # a background thread serializes and writes all dirty tasks in one
+    # transaction every flush_interval seconds.
+
+    def __init__(self, path, flush_interval=0.5, owner_timeout=30, retention=6 * 3600, on_cancel=None):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.owner_timeout = owner_timeout
+        self.retention = retention
+        self.on_cancel = on_cancel  # called with task_id when another worker asks to cancel
+        self.owner = OWNER_ID
+        self._local = threading.local()
+        self._pending = {}  # task_id -> TaskState
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._last_purge = 0.0
+        self.flushes = 0
+        self.rows_written = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                task_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                owner TEXT,
+                request TEXT,
+                state TEXT,
+                cancel_requested INTEGER NOT NULL DEFAULT 0,
+                created_at REAL,
+                updated_at REAL,
+                finished_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS tasks_status ON tasks(status);
+            CREATE TABLE IF NOT EXISTS workers (
+                owner TEXT PRIMARY KEY,
+                heartbeat REAL
+            );
+            CREATE TABLE IF NOT EXISTS batches (
+                batch_id TEXT PRIMARY KEY,
+                items TEXT NOT NULL,
+                created_at REAL
+            );
+        """)
+        conn.commit()
+        self._heartbeat(conn)
+
+        self._thread = threading.Thread(target=self._run, name="task-store", daemon=True)
+        self._thread.start()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    def record(self, task):
+        with self._lock:
+            self._pending[task.task_id] = task
+        if task.finished:
+            # Final states should be visible to other workers right away
+            self._wake.set()
+
+    def load(self, task_id):
+        with self._lock:
+            task = self._pending.get(task_id)
+        if task is not None:
+            return task.to_dict()
+        row = self._conn().execute(
+            "SELECT status, state, owner FROM tasks WHERE task_id = ?", (task_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        state = json.loads(row[1]) if row[1] else {}
+        state['status'] = row[0]
+        return state
+
+    def load_request(self, task_id):
+        row = self._conn().execute("SELECT request FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def request_cancel(self, task_id):
+        conn = self._conn()
+        cur = conn.execute(
+            "UPDATE tasks SET cancel_requested = 1 WHERE task_id = ? AND status IN ('queued', 'processing')",
+            (task_id,),
+        )
+        conn.commit()
+        return cur.rowcount > 0
+
+    def mark_interrupted(self):
+        # Unfinished tasks whose worker stopped heartbeating will never finish
+        cutoff = time.time() - self.owner_timeout
+        conn = self._conn()
+        with conn:
+            cur = conn.execute("""
+                UPDATE tasks SET status = 'interrupted'
+                WHERE status IN ('queued', 'processing') AND owner != ?
+                  AND owner NOT IN (SELECT owner FROM workers WHERE heartbeat >= ?)
+            """, (self.owner, cutoff))
+        return cur.rowcount
+
+    def interrupted(self, max_age):
+        # task_ids of interrupted tasks young enough to resume. Older ones are
+        # given up on (marked error) so their leftovers can be removed.
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "UPDATE tasks SET status = 'error', finished_at = ? "
+                "WHERE status = 'interrupted' AND COALESCE(updated_at, created_at, 0) < ?",
+                (now, now - max_age),
+            )
+        rows = conn.execute("SELECT task_id FROM tasks WHERE status = 'interrupted' ORDER BY created_at").fetchall()
+        return [task_id for (task_id,) in rows]
+
+    def claim_interrupted(self, task_id):
+        # Only one worker gets to resume a given task
+        conn = self._conn()
+        with conn:
+            cur = conn.execute(
+                "UPDATE tasks SET status = 'queued', owner = ?, updated_at = ? WHERE task_id = ? AND status = 'interrupted'",
+                (self.owner, time.time(), task_id),
+            )
+        return cur.rowcount > 0
+
+    def adopt(self, task_id, request):
+        # Claims a task the journal never heard of (its first flush was lost)
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO tasks (task_id, status, owner, request, created_at, updated_at) "
+                "VALUES (?, 'queued', ?, ?, ?, ?)",
+                (task_id, self.owner, json.dumps(request), now, now),
+            )
+        return cur.rowcount > 0
+
+    def unfinished(self):
+        # (task_id, status, owner, owner_alive) for tasks not yet in a final state
+        now = time.time()
+        rows = self._conn().execute("""
+            SELECT t.task_id, t.status, t.owner, w.heartbeat FROM tasks t
+            LEFT JOIN workers w ON w.owner = t.owner
+            WHERE t.status NOT IN (?, ?, ?)
+        """, FINISHED_STATES).fetchall()
+        return [
+            (task_id, status, owner, heartbeat is not None and now - heartbeat < self.owner_timeout)
+            for task_id, status, owner, heartbeat in rows
+        ]
+
+    def save_batch(self, batch_id, items, created_at):
+        # Batch membership only; item status comes from the tasks themselves
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO batches (batch_id, items, created_at) VALUES (?, ?, ?)",
+                (batch_id, json.dumps(items), created_at),
+            )
+
+    def load_batch(self, batch_id):
+        # (items, created_at) or None
+        row = self._conn().execute("SELECT items, created_at FROM batches WHERE batch_id = ?", (batch_id,)).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        rows = []
+        for task in pending.values():
+            rows.append((
+                task.task_id, task.status, self.owner,
+                json.dumps(task.request) if task.request is not None else None,
+                json.dumps(task.to_dict()),
+                task.created_at, task.updated_at, task.finished_at,
+            ))
+        conn = self._conn()
+        with conn:
+            conn.executemany("""
+                INSERT INTO tasks (task_id, status, owner, request, state, created_at, updated_at, finished_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(task_id) DO UPDATE SET
+                    status = excluded.status,
+                    owner = excluded.owner,
+                    request = COALESCE(excluded.request, tasks.request),
+                    state = excluded.state,
+                    updated_at = excluded.updated_at,
+                    finished_at = excluded.finished_at
+            """, rows)
+        self.flushes += 1
+        self.rows_written += len(rows)
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "owner": self.owner,
+            "pending_writes": pending,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+        }
+
+    def close(self):
+        self._stopping = True
+        self._wake.set()
+        self._thread.join(timeout=5)
+        self.flush()
+        # Stopped cleanly: other workers may take over our unfinished tasks right away
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM workers WHERE owner = ?", (self.owner,))
+
+    def _heartbeat(self, conn):
+        with conn:
+            conn.execute(
+                "INSERT INTO workers (owner, heartbeat) VALUES (?, ?) "
+                "ON CONFLICT(owner) DO UPDATE SET heartbeat = excluded.heartbeat",
+                (self.owner, time.time()),
+            )
+
+    def _poll_cancels(self, conn):
+        rows = conn.execute(
+            "SELECT task_id FROM tasks WHERE owner = ? AND cancel_requested = 1 AND status IN ('queued', 'processing')",
+            (self.owner,),
+        ).fetchall()
+        if rows:
+            with conn:
+                conn.executemany("UPDATE tasks SET cancel_requested = 0 WHERE task_id = ?", rows)
+            for (task_id,) in rows:
+                if self.on_cancel:
+                    self.on_cancel(task_id)
+
+    def _purge(self, conn):
+        now = time.time()
+        if now - self._last_purge < 60:
+            return
+        self._last_purge = now
+        with conn:
+            conn.execute("DELETE FROM tasks WHERE finished_at IS NOT NULL AND finished_at < ?", (now - self.retention,))
+            conn.execute("DELETE FROM workers WHERE heartbeat < ?", (now - self.retention,))
+            conn.execute("DELETE FROM batches WHERE created_at < ?", (now - self.retention,))
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            # Nothing may end this thread: without it nothing is journaled and
+            # the stopped heartbeat lets other workers take over live tasks
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Task store flush failed: {e!r}")
+            try:
+                conn = self._conn()
+                self._heartbeat(conn)
+                self._poll_cancels(conn)
+                self._purge(conn)
+            except Exception as e:
+                print(f"Task store error: {e!r}")
+
+
+def create_task_store(kind, path, **kwargs):
+    if kind == 'memory':
+        return MemoryTaskStore()
+    return SQLiteTaskStore(path, **kwargs)
@@ -0,0 +1,37 @@
+import threading
+import time
+
+from batches import Batch, summarize
+from scheduler import DownloadScheduler, LIGHT
+
+
+def test_summarize_reports_queue_position_of_queued_items():
+    # One worker, one connection per host: the first job runs, the others wait
+    scheduler = DownloadScheduler({LIGHT: 1}, per_host_limit=1)
+    release = threading.Event()
+    try:
+        for task_id in ('a', 'b', 'c'):
+            scheduler.submit(task_id, release.wait, args=(5,), host='example.com')
+        for _ in range(100):
+            if 'run_time' in (scheduler.describe('a') or {}):
+                break
+            time.sleep(0.01)
+        batch = Batch('batch', [
+            {"index": 0, "url": "u0", "task_id": 'a'},
+            {"index": 1, "url": "u1", "task_id": 'b'},
+            {"index": 2, "url": "u2", "task_id": 'c'},
+            {"index": 3, "url": "u2", "task_id": 'c', "duplicate_of": 2},
+        ])
+
+        def snapshot(task_id):
+            return {"status": 'queued', "progress": 0.0, **(scheduler.describe(task_id) or {})}
+
+        summary = summarize(batch, snapshot)
+        positions = {item['index']: item.get('queue_position') for item in summary['items']}
+        assert positions[1] == 1
+        assert positions[2] == 2
+        assert positions[3] == 2
+        assert all(item['lane'] == LIGHT for item in summary['items'])
+    finally:
+        release.set()
+        scheduler.shutdown()
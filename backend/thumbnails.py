@@ -0,0 +1,284 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import io
+import os
+import shutil
+import subprocess
+import threading
+import time
+import urllib.request
+from concurrent.futures import Future
+from urllib.parse import urlencode
+
+try:
+    from PIL import Image  # optional: faster resizing without an ffmpeg process per image
+except ImportError:
+    Image = None
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+_MAGIC = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+)
+
+
+class ThumbnailError(Exception):
+    pass
+
+
+def image_type(head):
+    # MIME type from the first bytes of an image, None if it is not one we serve
+    for magic, media_type in _MAGIC:
+        if head.startswith(magic):
+            return media_type
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+class ThumbnailCache:
+    # Playlist thumbnails fetched once from the origin, shrunk to list size
+    # and kept on disk, least recently used first out once the directory
+    # passes `max_bytes`. Proxy URLs are signed so the endpoint only fetches
+    # what the API itself handed out.
+    #
+    # Resizing uses Pillow when installed, ffmpeg otherwise; without either
+    # the original image is cached as is.
+
+    def __init__(self, root, max_bytes, width=320, secret=None, fetch_timeout=10, base_url=None, max_source_bytes=8 * 1024 * 1024):
+        self.root = root
+        self.base_url = base_url.rstrip('/') if base_url else None  # public API origin, wins over the request's
+        self.max_bytes = max_bytes
+        self.width = width
+        self.fetch_timeout = fetch_timeout
+        self.max_source_bytes = max_source_bytes
+        self.ffmpeg = shutil.which('ffmpeg')
+        os.makedirs(root, exist_ok=True)
+        self.secret = (secret or self._shared_secret()).encode()
+        self._lock = threading.Lock()
+        self._inflight = {}  # cache key -> Future
+        self._size = self._scan_size()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.failures = 0
+
+    def _shared_secret(self):
+        # Generated once and kept beside the cache: every worker signs alike and
+        # URLs the browser cached stay valid across restarts
+        path = os.path.join(self.root, '.secret')
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            for _ in range(50):
+                with open(path) as f:
+                    secret = f.read().strip()
+                if secret:
+                    return secret
+                time.sleep(0.01)  # another worker is writing it
+            raise ThumbnailError("Empty thumbnail secret")
+        secret = binascii.hexlify(os.urandom(32)).decode()
+        with os.fdopen(fd, 'w') as f:
+            f.write(secret)
+        return secret
+
+    def _sign(self, src):
+        return hmac.new(self.secret, f"{self.width}:{src}".encode(), hashlib.sha256).hexdigest()[:32]
+
+    def url_for(self, src, base_url=None):
+        # Proxy URL for an origin thumbnail URL; absolute when a base URL is known,
+        # so clients on another origin (or the dev frontend) reach this API
+        if not src or not src.startswith(('http://', 'https://')):
+            return src
+        base = self.base_url or (base_url or '').rstrip('/')
+        encoded = base64.urlsafe_b64encode(src.encode()).decode().rstrip('=')
+        return f"{base}/api/thumb?{urlencode({'u': encoded, 's': self._sign(src)})}"
+
+    def verify(self, encoded, signature):
+        # Origin URL from the u/s query parameters, None when they were not issued by us
+        try:
+            src = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)).decode()
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            return None
+        if not hmac.compare_digest(self._sign(src), signature or ''):
+            return None
+        return src
+
+    def _path(self, src):
+        key = hashlib.sha1(f"{self.width}:{src}".encode()).hexdigest()
+        return key, os.path.join(self.root, key[:2], key)
+
+    def get(self, src):
+        # (path, media type) of the cached thumbnail, fetching it on a miss.
+        # Concurrent misses for one image share a single fetch.
+        key, path = self._path(src)
+        media_type = self._cached_type(path)
+        if media_type is not None:
+            with self._lock:
+                self.hits += 1
+            return path, media_type
+
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                self.misses += 1
+                future = self._inflight[key] = Future()
+            else:
+                self.coalesced += 1
+        if not owner:
+            return future.result()
+
+        try:
+            result = self._fill(src, path)
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+                self.failures += 1
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._inflight.pop(key, None)
+        future.set_result(result)
+        return result
+
+    def load(self, src):
+        # (bytes, media type, etag); the image is small enough to send in one piece.
+        # Retried once in case another worker evicted it in between.
+        for _ in range(2):
+            path, media_type = self.get(src)
+            try:
+                with open(path, 'rb') as f:
+                    return f.read(), media_type, f'"{os.path.basename(path)}"'
+            except FileNotFoundError:
+                continue
+        raise ThumbnailError("Thumbnail evicted while serving")
+
+    def _cached_type(self, path):
+        try:
+            with open(path, 'rb') as f:
+                head = f.read(16)
+            os.utime(path)  # mtime is the LRU clock
+        except OSError:
+            return None
+        return image_type(head)
+
+    def _fill(self, src, path):
+        data = self._fetch(src)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            self._resize(data, tmp)
+            with open(tmp, 'rb') as f:
+                media_type = image_type(f.read(16))
+            if media_type is None:
+                raise ThumbnailError("Resized thumbnail is not an image")
+            size = os.path.getsize(tmp)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        with self._lock:
+            self._size += size
+            over = self.max_bytes and self._size > self.max_bytes
+        if over:
+            self._evict()
+        return path, media_type
+
+    def _fetch(self, src):
+        request = urllib.request.Request(src, headers={'User-Agent': USER_AGENT})
+        try:
+            with urllib.request.urlopen(request, timeout=self.fetch_timeout) as response:
+                data = response.read(self.max_source_bytes + 1)
+        except OSError as e:
+            raise ThumbnailError(f"Origin fetch failed: {e}")
+        if len(data) > self.max_source_bytes:
+            raise ThumbnailError("Origin image too large")
+        if image_type(data[:16]) is None:
+            raise ThumbnailError("Origin did not return an image")
+        return data
+
+    def _resize(self, data, dst):
+        if Image is not None:
+            try:
+                with Image.open(io.BytesIO(data)) as im:
+                    im.thumbnail((self.width, self.width * 4))
+                    im.convert('RGB').save(dst, 'JPEG', quality=80, optimize=True)
+                return
+            except Exception as e:
+                print(f"Thumbnail resize with Pillow failed ({e}), trying ffmpeg")
+        if self.ffmpeg:
+            src = f"{dst}.src"
+            with open(src, 'wb') as f:
+                f.write(data)
+            try:
+                subprocess.run([
+                    self.ffmpeg, '-y', '-v', 'error', '-i', src,
+                    '-vf', f"scale='min({self.width},iw)':-2", '-frames:v', '1',
+                    '-c:v', 'mjpeg', '-pix_fmt', 'yuvj420p', '-q:v', '5', '-f', 'image2', dst,
+                ], check=True, capture_output=True, timeout=30)
+                return
+            except (subprocess.SubprocessError, OSError) as e:
+                print(f"Thumbnail resize with ffmpeg failed ({e}), caching the original")
+            finally:
+                os.remove(src)
+        with open(dst, 'wb') as f:
+            f.write(data)
+
+    def _scan(self):
+        # [(mtime, size, path)] of every cached thumbnail
+        found = []
+        for bucket in os.scandir(self.root):
+            if not bucket.is_dir():
+                continue
+            for entry in os.scandir(bucket.path):
+                if entry.name.endswith('.tmp') or entry.name.endswith('.src'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, stat.st_size, entry.path))
+        return found
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._scan())
+
+    def _evict(self):
+        # Rescans so files written by other workers count too; trims to 90% of the quota
+        files = sorted(self._scan())
+        total = sum(size for _, size, _ in files)
+        target = self.max_bytes * 0.9
+        removed = 0
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        with self._lock:
+            self._size = total
+            self.evictions += removed
+
+    def stats(self):
+        with self._lock:
+            return {
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "width": self.width,
+                "resizer": "pillow" if Image is not None else "ffmpeg" if self.ffmpeg else "none",
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "failures": self.failures,
+            }
@@ -0,0 +1,286 @@
+import os
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION, TimeoutError as FutureTimeout
+
+import media_probe
+
+
+class TranscodeError(Exception):
+    pass
+
+
+class _Stopped(Exception):
+    pass
+
+
+class Transcoder:
+    # Every ffmpeg invocation after download: muxing, audio conversion and upscaling.
+    #
+    # Upscales a video by splitting it at keyframes (stream copy, no decode),
+    # encoding the segments as separate ffmpeg processes in parallel and
+    # joining the results with the concat demuxer (again stream copy).
+    #
+    # All jobs share one pool of `max_workers` encoder slots, so two heavy
+    # jobs running at once split the cores instead of oversubscribing them.
+
+    def __init__(self, max_workers, threads_per_job=0, segment_seconds=20, preset=None):
+        self.ffmpeg = shutil.which('ffmpeg')
+        self.cpus = os.cpu_count() or 2
+        self.threads_per_job = threads_per_job  # 0 = pick per job
+        self.segment_seconds = segment_seconds
+        self.preset = preset  # None = pick per job
+        self.max_workers = max(1, max_workers)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="transcode")
+        self._lock = threading.Lock()
+        self._running = 0
+        self._jobs = 0
+        self._segments = 0
+        self._encode_seconds = 0.0
+
+    def pick_settings(self, duration, target_height):
+        # (preset, threads per ffmpeg process). Work is measured in 1080p-seconds:
+        # a 10 minute 4320p target is 16x the pixels of the same clip at 1080p.
+        work = (duration or 60) * (target_height / 1080) ** 2
+        if self.preset:
+            preset = self.preset
+        elif work < 300:
+            preset = 'medium'
+        elif work < 3000:
+            preset = 'fast'
+        elif work < 20000:
+            preset = 'faster'
+        else:
+            preset = 'veryfast'
+
+        if self.threads_per_job > 0:
+            threads = self.threads_per_job
+        else:
+            # x264 scales well up to a few threads per frame row; bigger frames take more
+            threads = 4 if target_height >= 2160 else 2
+        threads = max(1, min(threads, self.cpus))
+        return preset, threads
+
+    def upscale(self, src, dst, target_height, check=None, audio_bitrate='192k'):
+        # Writes an H.264/AAC mp4 scaled to target_height. `check` is called
+        # while ffmpeg runs; whatever it raises aborts the job (processes are killed).
+        if not self.ffmpeg:
+            raise TranscodeError("FFmpeg not available")
+        info = media_probe.probe(src)
+        duration = media_probe.duration(info)
+        preset, threads = self.pick_settings(duration, target_height)
+        segment = self._segment_length(duration)
+        audio_args = self.audio_args(info, 'mp4', audio_bitrate)
+        started = time.monotonic()
+        with self._lock:
+            self._jobs += 1
+
+        if segment is None:
+            self._encode_single(src, dst, target_height, preset, threads, audio_args, check)
+        else:
+            work_dir = f"{dst}.segments"
+            try:
+                self._encode_segmented(src, dst, work_dir, target_height, preset, threads, segment, audio_args, check)
+            except (TranscodeError, subprocess.SubprocessError) as e:
+                print(f"Segmented transcode failed ({e}), falling back to single pass")
+                self._encode_single(src, dst, target_height, preset, threads, audio_args, check)
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+        print(f"Transcode {os.path.basename(src)} -> {target_height}p took {time.monotonic() - started:.1f}s")
+        return dst
+
+    def audio_args(self, info, container, bitrate='192k'):
+        # Copy the audio stream when the container takes its codec, AAC otherwise
+        name = media_probe.codec(info, 'audio')
+        if name and media_probe.can_copy(container, 'audio', name):
+            return ['-c:a', 'copy']
+        return ['-c:a', 'aac', '-b:a', bitrate]
+
+    def video_args(self, info, container):
+        name = media_probe.codec(info, 'video')
+        # Unknown codec (no ffprobe): copy, as yt-dlp's own merger would
+        if name is None or media_probe.can_copy(container, 'video', name):
+            return ['-c:v', 'copy']
+        return ['-c:v', 'libx264', '-preset', 'fast', '-pix_fmt', 'yuv420p']
+
+    def merge(self, video, audio, dst, check=None):
+        # Muxes separately downloaded streams, re-encoding only what dst's container rejects
+        container = os.path.splitext(dst)[1].lstrip('.')
+        video_info = media_probe.probe(video)
+        audio_info = media_probe.probe(audio)
+        cmd = [self.ffmpeg, '-y', '-v', 'error', '-i', video, '-i', audio, '-map', '0:v:0', '-map', '1:a:0']
+        cmd += self.video_args(video_info, container) + self.audio_args(audio_info, container)
+        cmd.append(dst)
+        print(f"Merge {os.path.basename(video)} + {os.path.basename(audio)}: {' '.join(cmd[-5:-1])}")
+        self._run(cmd, check)
+        return dst
+
+    def audio_variants(self, src, outputs, check=None):
+        # Writes one mp3 per (path, kbps) in `outputs` from a single decode of src.
+        # A single target is stream-copied when src already is an mp3 of at most that bitrate.
+        info = media_probe.probe(src)
+        if len(outputs) == 1:
+            path, kbps = outputs[0]
+            source_rate = media_probe.bitrate(info, 'audio')
+            if media_probe.codec(info, 'audio') == 'mp3' and (not source_rate or source_rate <= kbps * 1000 * 1.05):
+                print(f"Audio {os.path.basename(src)}: already mp3, copying")
+                self._run([self.ffmpeg, '-y', '-v', 'error', '-i', src, '-map', '0:a:0', '-c:a', 'copy', path], check)
+                return [path]
+        cmd = [self.ffmpeg, '-y', '-v', 'error', '-i', src]
+        for path, kbps in outputs:
+            cmd += ['-map', '0:a:0', '-c:a', 'libmp3lame', '-b:a', f'{kbps}k', path]
+        self._run(cmd, check)
+        return [path for path, _ in outputs]
+
+    def _segment_length(self, duration):
+        # None when the clip is too short (or unknown) to be worth splitting
+        if not duration or self.max_workers < 2:
+            return None
+        length = min(self.segment_seconds, duration / self.max_workers)
+        length = max(length, 4)
+        if duration < 2 * length:
+            return None
+        return length
+
+    def _scale_args(self, target_height, preset, threads):
+        return [
+            '-vf', f'scale=-2:{target_height}:flags=lanczos',
+            '-c:v', 'libx264',
+            '-preset', preset,
+            '-threads', str(threads),
+            '-pix_fmt', 'yuv420p',
+        ]
+
+    def _encode_single(self, src, dst, target_height, preset, threads, audio_args, check):
+        # Whole file in one process, run in one of the shared encoder slots
+        # with that slot's share of the cores
+        threads = max(threads, self.cpus // self.max_workers)
+        print(f"Transcode {os.path.basename(src)}: single pass ({preset}, {threads} threads)")
+        cmd = [self.ffmpeg, '-y', '-v', 'error', '-i', src, '-map', '0:v:0', '-map', '0:a?']
+        cmd += self._scale_args(target_height, preset, threads)
+        cmd += audio_args + ['-movflags', '+faststart', dst]
+        stop = threading.Event()
+        future = self._pool.submit(self._encode_segment, cmd, stop)
+        try:
+            while True:
+                try:
+                    future.result(timeout=0.5)
+                    return
+                except FutureTimeout:
+                    pass
+                if check:
+                    check()
+        except BaseException:
+            stop.set()
+            future.cancel()
+            wait([future])
+            raise
+
+    def _encode_segmented(self, src, dst, work_dir, target_height, preset, threads, segment, audio_args, check):
+        os.makedirs(work_dir, exist_ok=True)
+        # 1. Split the video stream at keyframes. Copying means every segment
+        #    starts on a keyframe and can be decoded on its own.
+        self._run([
+            self.ffmpeg, '-y', '-v', 'error', '-i', src,
+            '-map', '0:v:0', '-c', 'copy',
+            '-f', 'segment', '-segment_time', f'{segment:.3f}', '-reset_timestamps', '1',
+            os.path.join(work_dir, 'src_%05d.mkv'),
+        ], check)
+        sources = sorted(f for f in os.listdir(work_dir) if f.startswith('src_'))
+        if not sources:
+            raise TranscodeError("Segmenter produced no output")
+        print(f"Transcode {os.path.basename(src)}: {len(sources)} segments x {threads} threads ({preset})")
+
+        # 2. Encode segments concurrently
+        stop = threading.Event()
+        outputs = []
+        futures = []
+        for name in sources:
+            seg_in = os.path.join(work_dir, name)
+            seg_out = os.path.join(work_dir, name.replace('src_', 'enc_').replace('.mkv', '.mp4'))
+            cmd = [self.ffmpeg, '-y', '-v', 'error', '-i', seg_in, '-an']
+            cmd += self._scale_args(target_height, preset, threads)
+            cmd.append(seg_out)
+            outputs.append(seg_out)
+            futures.append(self._pool.submit(self._encode_segment, cmd, stop))
+        try:
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=0.5, return_when=FIRST_EXCEPTION)
+                for future in done:
+                    future.result()
+                if check:
+                    check()
+        except BaseException:
+            stop.set()
+            for future in futures:
+                future.cancel()
+            wait(futures)
+            raise
+
+        # 3. Join the encoded segments and add the original audio
+        list_file = os.path.join(work_dir, 'concat.txt')
+        with open(list_file, 'w') as f:
+            for path in outputs:
+                f.write(f"file '{path}'\n")
+        self._run([
+            self.ffmpeg, '-y', '-v', 'error',
+            '-f', 'concat', '-safe', '0', '-i', list_file,
+            '-i', src,
+            '-map', '0:v:0', '-map', '1:a?',
+            '-c:v', 'copy', *audio_args,
+            '-movflags', '+faststart', dst,
+        ], check)
+
+    def _encode_segment(self, cmd, stop):
+        if stop.is_set():
+            raise _Stopped()
+        with self._lock:
+            self._running += 1
+        started = time.monotonic()
+        try:
+            self._run(cmd, stop_event=stop)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._segments += 1
+                self._encode_seconds += time.monotonic() - started
+
+    def _run(self, cmd, check=None, stop_event=None):
+        proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        try:
+            while True:
+                try:
+                    proc.wait(timeout=0.5)
+                    break
+                except subprocess.TimeoutExpired:
+                    pass
+                if stop_event is not None and stop_event.is_set():
+                    raise _Stopped()
+                if check:
+                    check()
+        except BaseException:
+            proc.kill()
+            proc.wait()
+            raise
+        finally:
+            stderr = proc.stderr.read().decode(errors='replace') if proc.stderr else ''
+            if proc.stderr:
+                proc.stderr.close()
+        if proc.returncode != 0:
+            raise TranscodeError(stderr.strip().splitlines()[-1] if stderr.strip() else f"ffmpeg exited with {proc.returncode}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "running_segments": self._running,
+                "jobs": self._jobs,
+                "segments_encoded": self._segments,
+                "encode_seconds": round(self._encode_seconds, 1),
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,171 @@
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+# Options a checkout may change. yt-dlp reads these at use time, everything
+# else is baked into the instance when it is built (format_selector, hooks,
+# request handlers, cookie jar) and has to come from the profile.
+PER_USE_OPTIONS = {
+    'outtmpl', 'format', 'noplaylist', 'yes_playlist', 'playlist_items', 'lazy_playlist',
+    'concurrent_fragment_downloads', 'http_chunk_size', 'buffersize',
+}
+HOOK_OPTIONS = {'progress_hooks', 'postprocessor_hooks', 'post_hooks'}
+
+
+class _Slot:
+    __slots__ = ('ydl', 'params', 'format_selector', 'uses')
+
+    def __init__(self, ydl):
+        self.ydl = ydl
+        # Options as normalized by YoutubeDL.__init__, restored before every use
+        self.params = dict(ydl.params)
+        self.params['outtmpl'] = dict(ydl.params['outtmpl'])
+        self.format_selector = ydl.format_selector
+        self.uses = 0
+
+
+class YDLPool:
+    # Pre-built yt_dlp.YoutubeDL instances per option profile. Constructing
+    # one costs ~0.1s (option normalization, request handlers, cookie jar,
+    # debug header probes in verbose mode); here it is paid once per
+    # instance, and the instance keeps its HTTP connections between uses.
+    #
+    # A YoutubeDL is not thread safe: checkout() hands an instance to one
+    # caller, building a new one when every idle one is taken, and resets it
+    # to its profile before the next use. At most `max_idle` instances per
+    # profile are kept; each is retired after `max_uses` checkouts.
+
+    def __init__(self, profiles, max_idle=4, max_uses=200):
+        self.profiles = profiles  # name -> YoutubeDL options
+        self.max_idle = max_idle
+        self.max_uses = max_uses
+        self._idle = {name: deque() for name in profiles}
+        self._lock = threading.Lock()
+        self._closed = False
+        self.warm = False
+        self.created = 0
+        self.reused = 0
+        self.retired = 0
+
+    def start_warmup(self, per_profile=1):
+        # Imports yt-dlp and builds the first instances off the request path
+        thread = threading.Thread(target=self._warmup, args=(per_profile,), name="ydl-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def _warmup(self, per_profile):
+        try:
+            for name in self.profiles:
+                for _ in range(per_profile):
+                    slot = self._build(name)
+                    self._release(name, slot)
+            self.warm = True
+        except Exception as e:
+            print(f"YoutubeDL warmup failed: {e}")
+
+    def acquire(self, profile, **options):
+        # (ydl, release). For callers that hand the instance on, e.g. to a
+        # streaming response; everyone else should use checkout().
+        slot = None
+        with self._lock:
+            idle = self._idle[profile]
+            if idle:
+                slot = idle.pop()
+                self.reused += 1
+        if slot is None:
+            slot = self._build(profile)
+        slot.uses += 1
+        try:
+            self._reset(slot, options)
+        except BaseException:
+            self._release(profile, slot)
+            raise
+        released = []
+
+        def release():
+            if not released:
+                released.append(True)
+                self._release(profile, slot)
+
+        return slot.ydl, release
+
+    @contextmanager
+    def checkout(self, profile, **options):
+        ydl, release = self.acquire(profile, **options)
+        try:
+            yield ydl
+        finally:
+            release()
+
+    def _build(self, profile):
+        import yt_dlp  # deferred: the import alone takes ~0.1s
+        ydl = yt_dlp.YoutubeDL(dict(self.profiles[profile]))
+        with self._lock:
+            self.created += 1
+        return _Slot(ydl)
+
+    def _reset(self, slot, options):
+        unknown = set(options) - PER_USE_OPTIONS - HOOK_OPTIONS
+        if unknown:
+            raise ValueError(f"Options fixed by the profile: {', '.join(sorted(unknown))}")
+        ydl = slot.ydl
+        ydl.params.clear()
+        ydl.params.update(slot.params)
+        ydl.params['outtmpl'] = dict(slot.params['outtmpl'])
+        ydl.format_selector = slot.format_selector
+        for key, value in options.items():
+            if key in HOOK_OPTIONS:
+                continue
+            ydl.params[key] = value
+        if 'outtmpl' in options:
+            ydl.params['outtmpl'] = {'default': options['outtmpl']}
+            ydl._parse_outtmpl()
+        if 'format' in options:
+            ydl.format_selector = ydl.build_format_selector(options['format'])
+        ydl._progress_hooks[:] = options.get('progress_hooks') or []
+        ydl._postprocessor_hooks[:] = options.get('postprocessor_hooks') or []
+        ydl._post_hooks[:] = options.get('post_hooks') or []
+        # Per-run bookkeeping
+        ydl._download_retcode = 0
+        ydl._num_downloads = 0
+        ydl._num_videos = 0
+        ydl._playlist_level = 0
+        ydl._playlist_urls = set()
+
+    def _release(self, profile, slot):
+        with self._lock:
+            keep = not self._closed and slot.uses < self.max_uses and len(self._idle[profile]) < self.max_idle
+            if keep:
+                slot.ydl._progress_hooks[:] = []
+                slot.ydl._postprocessor_hooks[:] = []
+                slot.ydl._post_hooks[:] = []
+                self._idle[profile].append(slot)
+            else:
+                self.retired += 1
+        if not keep:
+            self._close(slot)
+
+    def _close(self, slot):
+        try:
+            slot.ydl.close()
+        except Exception as e:
+            print(f"YoutubeDL close failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "warm": self.warm,
+                "idle": {name: len(idle) for name, idle in self._idle.items()},
+                "created": self.created,
+                "reused": self.reused,
+                "retired": self.retired,
+            }
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            slots = [slot for idle in self._idle.values() for slot in idle]
+            for idle in self._idle.values():
+                idle.clear()
+        for slot in slots:
+            self._close(slot)
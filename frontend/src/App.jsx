@@ -3,6 +3,45 @@ import { Download, Link, Loader2, CheckCircle2, AlertCircle, Youtube, Instagram,
 
 const API_BASE = import.meta.env.PROD ? '' : 'http://localhost:8000';
 
+// One shared WebSocket for progress pushes; listeners keyed by task id.
+// Falls back to polling /api/status when the socket cannot be used.
+const progressSocket = {
+  ws: null,
+  listeners: new Map(),
+
+  connect() {
+    if (this.ws && this.ws.readyState <= 1) return this.ws;
+    const base = API_BASE || window.location.origin;
+    this.ws = new WebSocket(`${base.replace(/^http/, 'ws')}/ws/progress`);
+    this.ws.onopen = () => {
+      if (this.listeners.size) this.ws.send(JSON.stringify({ subscribe: [...this.listeners.keys()] }));
+    };
+    this.ws.onmessage = (event) => {
+      const data = JSON.parse(event.data);
+      const listener = this.listeners.get(data.task_id);
+      if (listener) listener.onUpdate(data);
+    };
+    this.ws.onclose = () => {
+      this.ws = null;
+      // Hand every live task over to polling
+      for (const listener of this.listeners.values()) listener.onSocketLost();
+      this.listeners.clear();
+    };
+    return this.ws;
+  },
+
+  watch(taskId, onUpdate, onSocketLost) {
+    this.listeners.set(taskId, { onUpdate, onSocketLost });
+    const ws = this.connect();
+    if (ws.readyState === 1) ws.send(JSON.stringify({ subscribe: [taskId] }));
+  },
+
+  unwatch(taskId) {
+    this.listeners.delete(taskId);
+    if (this.ws && this.ws.readyState === 1) this.ws.send(JSON.stringify({ unsubscribe: [taskId] }));
+  }
+};
+
 function formatSize(bytes) {
   if (!bytes) return '';
   const sizes = ['Bytes', 'KB', 'MB', 'GB', 'TB'];
@@ -58,6 +97,17 @@ export default function MediaDownloader() {
     }));
   };
 
+  const appendEntries = (entries) => {
+    setTabsData(prev => {
+      const info = prev[platform].mediaInfo;
+      if (!info) return prev;
+      return {
+        ...prev,
+        [platform]: { ...prev[platform], mediaInfo: { ...info, entries: [...(info.entries || []), ...entries] } }
+      };
+    });
+  };
+
   const setPlaylistStart = (val) => {
     setTabsData(prev => ({
       ...prev,
@@ -140,22 +190,50 @@ export default function MediaDownloader() {
       // Or auto-switch? The user said "switch during this insta or playlist they not show", 
       // implying isolation. So we stick to current platform if possible, or just send 'currentPlatform' to backend.
 
-      const res = await fetch(`${API_BASE}/api/extract`, {
+      // Streamed as NDJSON: playlist rows render as soon as yt-dlp yields them
+      const res = await fetch(`${API_BASE}/api/extract/stream`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ url: activeData.url, platform: detectionPlatform, type: downloadType, quality: '1080' })
       });
-      const data = await res.json();
-      if (res.ok) {
-        setMediaInfo(data);
-        setIsPlaying(false);
-        if (data.is_playlist && data.entries) {
-          setPlaylistStart(1);
-          setPlaylistEnd(Math.min(data.count, 10));
-        }
-      } else {
+      if (!res.ok || !res.body) {
         setStatus({ type: 'error', message: 'Could not fetch details. Check URL.' });
+        return;
+      }
+
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffered = '';
+      let total = 0;
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffered += decoder.decode(value, { stream: true });
+        const lines = buffered.split('\n');
+        buffered = lines.pop();
+
+        const batch = [];
+        for (const line of lines) {
+          if (!line.trim()) continue;
+          const msg = JSON.parse(line);
+          if (msg.type === 'media') {
+            setMediaInfo(msg);
+            setIsPlaying(false);
+          } else if (msg.type === 'playlist') {
+            setMediaInfo({ ...msg, entries: [] });
+            setIsPlaying(false);
+            setPlaylistStart(1);
+          } else if (msg.type === 'entry') {
+            batch.push(msg);
+          } else if (msg.type === 'end') {
+            total = msg.count;
+          } else if (msg.type === 'error') {
+            setStatus({ type: 'error', message: 'Could not fetch details. Check URL.' });
+          }
+        }
+        if (batch.length) appendEntries(batch);
       }
+      if (total) setPlaylistEnd(Math.min(total, 10));
     } catch (e) {
       setStatus({ type: 'error', message: 'Connection Error' });
     } finally {
@@ -201,55 +279,75 @@ export default function MediaDownloader() {
 
       const { task_id } = await res.json();
 
-      const interval = setInterval(async () => {
-        try {
-          const statusRes = await fetch(`${API_BASE}/api/status/${task_id}`);
-          if (!statusRes.ok) return;
-
-          const data = await statusRes.json();
-
-          if (data.status === 'processing') {
-            setStatus({
-              type: 'info',
-              message: data.current_file ? `Downloading: ${data.current_file}` : `Downloading... ${Math.round(data.progress)}%`,
-              subMessage: data.playlist_index ? `File ${data.playlist_index} of ${data.playlist_total}` : null,
-              speed: data.speed,
-              eta: data.eta
-            });
-            setProgress(data.progress);
-          } else if (data.status === 'completed') {
-            clearInterval(interval);
-            setLoading(false);
-            setProgress(100);
-            setStatus({ type: 'success', message: 'Download Complete!' });
-
-            // Auto-Download Trigger
-            const trigger = (fid) => {
-              const link = document.createElement('a');
-              link.href = `${API_BASE}/api/file/${fid}`;
-              link.setAttribute('download', ''); // Force download
-              document.body.appendChild(link);
-              link.click();
-              document.body.removeChild(link);
-            };
-
-            if (data.files && data.files.length > 0) {
-              // Playlist: Download all files with small stagger
-              data.files.forEach((f, i) => setTimeout(() => trigger(f), i * 800));
-              setDownloadLink(`${API_BASE}/api/file/${data.files[0]}`); // Fallback link
-            } else {
-              trigger(data.file_id);
-              setDownloadLink(`${API_BASE}/api/file/${data.file_id}`);
-            }
-          } else if (data.status === 'error') {
-            clearInterval(interval);
-            setLoading(false);
-            setStatus({ type: 'error', message: data.error || 'Download failed' });
-          }
-        } catch (e) {
-          console.error("Polling error", e);
+      let interval = null;
+      const stopWatching = () => {
+        if (interval) clearInterval(interval);
+        progressSocket.unwatch(task_id);
+      };
+
+      const handleUpdate = (data) => {
+        if (data.status === 'queued') {
+          setStatus({
+            type: 'info',
+            message: data.queue_position ? `Queued (position ${data.queue_position})` : 'Queued...'
+          });
+        } else if (data.status === 'processing') {
+          setStatus({
+            type: 'info',
+            message: data.current_file ? `Downloading: ${data.current_file}` : `Downloading... ${Math.round(data.progress)}%`,
+            subMessage: data.playlist_total ? `${data.playlist_index || 0} of ${data.playlist_total} files done` : null,
+            speed: data.speed,
+            eta: data.eta
+          });
+          setProgress(data.progress);
+        } else if (data.status === 'interrupted') {
+          // The server picks the task up again when it restarts: keep watching
+          setStatus({ type: 'info', message: 'Resuming after server restart...' });
+        } else if (data.status === 'completed') {
+          stopWatching();
+          setLoading(false);
+          setProgress(100);
+          setStatus({ type: 'success', message: 'Download Complete!' });
+
+          // Auto-Download Trigger
+          const trigger = (url) => {
+            const link = document.createElement('a');
+            link.href = url;
+            link.setAttribute('download', ''); // Force download
+            document.body.appendChild(link);
+            link.click();
+            document.body.removeChild(link);
+          };
+
+          // Playlist folders are served as a single streamed ZIP
+          const fileUrl = `${API_BASE}/api/file/${encodeURIComponent(data.file_id)}`;
+          trigger(fileUrl);
+          setDownloadLink(fileUrl);
+        } else if (data.status === 'error' || data.status === 'cancelled') {
+          stopWatching();
+          setLoading(false);
+          setStatus({ type: 'error', message: data.error || (data.status === 'cancelled' ? 'Download cancelled' : 'Download failed') });
         }
-      }, 500);
+      };
+
+      const startPolling = () => {
+        if (interval) return;
+        interval = setInterval(async () => {
+          try {
+            const statusRes = await fetch(`${API_BASE}/api/status/${task_id}`);
+            if (!statusRes.ok) return;
+            handleUpdate(await statusRes.json());
+          } catch (e) {
+            console.error("Polling error", e);
+          }
+        }, 500);
+      };
+
+      try {
+        progressSocket.watch(task_id, handleUpdate, startPolling);
+      } catch (e) {
+        startPolling();
+      }
 
     } catch (err) {
       setLoading(false);